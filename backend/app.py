@@ -1,184 +1,492 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import requests
 import os
 import random
 import logging
 import re
+import math
+import time
+import asyncio
 import json  # Import json module for parsing JSON responses
+import functools
+import threading
+from session_store import SessionStore
+from ollama_client import OllamaClient
+from background_loop import get_loop, run_sync, iterate_sync
+from streaming import TokenRelay, sse_event
+import fast_path
+from response_cache import ResponseCache
+from phrasing import PhrasingPool
+from prompt_layout import window_history
+from metrics import MetricsRegistry
+from warmup import ModelWarmer
+from policy import ConcessionPolicy
+from catalog import Catalog
+import scheduler
+from scheduler import SchedulerRejected, PRIORITY_CHAT, PRIORITY_AUX, PRIORITY_BACKGROUND
 
 app = Flask(__name__)
 CORS(app)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Store conversation history and attempts
-conversation_history = [] 
-negotiation_attempts = 0  
-negotiation_closed = False  # Track if the negotiation has ended
-LAST_NEGOTIATED_PRICE = 1500  
-
 MODEL = "llama3.2"
 
 # Constants
 MAX_ATTEMPTS = 5  
-MIN_PRICE = 1200 
-ACTUAL_PRICE = 1500
 CURRENCY = "£"
 COMPANY_NAME = "Elite Wheels"
+CATALOG_PATH = os.environ.get('CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.jsonl'))  # JSON Lines, or SQLite for large catalogs
+DEFAULT_SKU = os.environ.get('DEFAULT_SKU', 'WHEELS-4')  # Negotiated when /initialize doesn't name a product
+CATALOG_MAX_CACHED_PRODUCTS = 4096
 OLLAMA_API_URL = 'http://localhost:11434/api/chat'  # Adjust if necessary
+OLLAMA_API_URLS = [url.strip() for url in os.environ.get('OLLAMA_API_URLS', OLLAMA_API_URL).split(',') if url.strip()]  # Comma-separated, to spread load over several servers
+SESSION_TTL_SECONDS = 30 * 60  # Abandoned negotiations are dropped after this long
+MAX_SESSIONS = 10000  # Held in memory per process; with SESSION_DB the rest are reloaded from disk on demand
+SESSION_DB_PATH = os.environ.get('SESSION_DB')  # SQLite file shared by every worker process, unset for memory only
+SESSION_FLUSH_INTERVAL_SECONDS = 0.05  # How often a failed write of saved sessions is retried
+SESSION_COMPACT_INTERVAL_SECONDS = 300  # How often expired sessions are deleted from SESSION_DB
+OLLAMA_TIMEOUT_SECONDS = 120  # Negotiation replies can take a while on a cold model
+OLLAMA_AUX_TIMEOUT_SECONDS = 30  # Classification, extraction and rephrasing calls
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get('OLLAMA_NUM_PARALLEL', 4))  # Per server in rotation; match the requests each Ollama runs in parallel, the rest queue here by priority
+OLLAMA_MAX_QUEUE = 64  # Calls allowed to wait for a slot before new turns are turned away
+OLLAMA_FAILURE_THRESHOLD = 3  # Consecutive failures before a server is ejected
+OLLAMA_EJECT_SECONDS = 15  # How long an ejected server is left alone before a trial call
+OLLAMA_HEALTH_INTERVAL_SECONDS = 10
+OLLAMA_HEDGE_DELAY_SECONDS = 1.0  # Classification and extraction calls slower than this are also sent to a second server
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '-1m')  # How long Ollama keeps the model loaded after a call, negative for indefinitely
+WARMUP_INTERVAL_SECONDS = 240  # Servers idle for this long get the model warmed again
+WARMUP_RETRY_SECONDS = 15  # Servers the model has never loaded on are retried this often
+WARM_AFTER_FORK = True  # Flask workers forked from a preloaded app warm up at once; the ASGI app warms in its lifespan instead
+TURN_DEADLINE_SECONDS = 60  # A turn's LLM calls must finish within this, or the buyer is asked to try again
+FAST_PATH_MIN_CONFIDENCE = 0.8  # Below this, buyer messages are analyzed by the LLM
+RESPONSE_CACHE_MAX_ENTRIES = 10000
+RESPONSE_CACHE_TTL_SECONDS = 24 * 3600
+RESPONSE_CACHE_DB_PATH = os.environ.get('RESPONSE_CACHE_DB')  # SQLite file that survives restarts, unset for memory only
+STATE_DIR = os.environ.get('NEGOTIATOR_STATE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'negotiator'))  # Files written at runtime, kept out of the source tree
+PHRASING_POOL_PATH = os.environ.get('PHRASING_POOL', os.path.join(STATE_DIR, 'phrasing_pool.json'))
+PHRASING_VARIANTS = 8  # Renderings generated per fixed bot message
+PHRASING_MAX_AGE_SECONDS = 7 * 24 * 3600
+HISTORY_TOKEN_BUDGET = 300  # Estimated tokens of recent turns sent verbatim with each negotiation call
+MAX_OFFERS_IN_FACTS = 8  # Latest offers listed in the session facts
+CONCESSION_SHAPE = 0.75  # Below 1 concedes early, above 1 late; best margin per buyer in benchmarks/simulate_policy.py
+ACCEPT_WITHIN = 0.02  # Buyer offers this close to our next counteroffer are accepted
+PAYLOAD_LOG_SAMPLE_RATE = 0.01  # Fraction of Ollama payloads logged in full, at DEBUG level
+
+# Timings, token counts and outcomes of every LLM call, plus negotiation counters, served on /metrics
+metrics = MetricsRegistry()
+metrics.describe('llm_call_duration_seconds', "Duration of Ollama calls by call site and outcome.")
+metrics.describe('llm_errors_total', "Ollama calls that failed, by call site.")
+metrics.describe('llm_prompt_tokens_total', "Prompt tokens Ollama evaluated, by call site.")
+metrics.describe('llm_eval_tokens_total', "Tokens Ollama generated, by call site.")
+metrics.describe('turns_total', "Negotiation turns handled.")
+metrics.describe('turn_duration_seconds', "Time to handle a negotiation turn.")
+metrics.describe('deals_closed_total', "Negotiations that ended in a deal.")
+metrics.describe('rejections_total', "Negotiations the buyer walked away from.")
+metrics.describe('attempts_exhausted_total', "Negotiations that hit the maximum number of attempts.")
+metrics.describe('turns_rejected_total', "Turns turned away because Ollama was too busy.")
+metrics.describe('scheduler_wait_seconds', "Time LLM calls spent queued for a slot, by priority.")
+
+# Shared by every session, so Ollama can reuse its evaluated prefix across products
+NEGOTIATOR_INSTRUCTIONS = (
+    f"You are a friendly and suave British price negotiator working for {COMPANY_NAME}. "
+    "The negotiation facts after the conversation give the price to offer now. "
+    "Offer exactly that price and no other, in the format '£<price>' or '<price> GBP', and don't mention the discount amount. "
+    "If the user's offer is less than 50% of the list price tell them that we won't have a deal with this kind of offer so please try to do better. "
+    "Don't mention the price that the user offered, and never say you accept an offer."
+)
+
+def format_price(price):
+    """Format a price in full with thousands separators, and without pence when it's whole: 12,999.99 or 1,500."""
+    text = f"{price:,.2f}"
+    return text[:-3] if text.endswith('.00') else text
+
+def format_amount(price):
+    """Format a price as buyers and the model see it, currency first: £1,440."""
+    return f"{CURRENCY}{format_price(price)}"
+
+def build_system_message(product):
+    """
+    Build the system prompt for negotiating `product`. The catalog caches it with the product,
+    and it never changes between sessions, so Ollama can reuse its evaluated prefix.
+    Everything specific to a session goes in the trailing facts message instead.
+    """
+    return {
+        "role": "system",
+        "content": f"{NEGOTIATOR_INSTRUCTIONS} You are selling {product.description}, list price {format_amount(product.list_price)}."
+    }
 
-def get_ollama_response(user_message):
-    global negotiation_attempts, LAST_NEGOTIATED_PRICE, negotiation_closed, conversation_history
-
-    if negotiation_closed:
+@functools.lru_cache(maxsize=1024)
+def concession_policy(floor):
+    """The policy deciding every counteroffer and acceptance for products with this floor price."""
+    return ConcessionPolicy(floor, MAX_ATTEMPTS, shape=CONCESSION_SHAPE, accept_within=ACCEPT_WITHIN)
+
+# Every product that can be negotiated, read from disk on first use
+catalog = Catalog(CATALOG_PATH, compile_prompt=build_system_message, max_cached=CATALOG_MAX_CACHED_PRODUCTS)
+
+# Negotiation state for every buyer, keyed by the session id issued by /initialize
+sessions = SessionStore(
+    ttl=SESSION_TTL_SECONDS,
+    max_sessions=MAX_SESSIONS,
+    db_path=SESSION_DB_PATH,
+    resolve_product=catalog.get,
+    flush_interval=SESSION_FLUSH_INTERVAL_SECONDS,
+    compact_interval=SESSION_COMPACT_INTERVAL_SECONDS
+)
+
+# One pooled, keep-alive client shared by every Ollama call in the process, routing over every server
+ollama = OllamaClient(
+    OLLAMA_API_URLS,
+    timeout=OLLAMA_TIMEOUT_SECONDS,
+    max_concurrency=OLLAMA_MAX_CONCURRENCY,
+    max_queue=OLLAMA_MAX_QUEUE,
+    on_wait=lambda priority, seconds: metrics.observe('scheduler_wait_seconds', seconds, priority=priority),
+    failure_threshold=OLLAMA_FAILURE_THRESHOLD,
+    reset_timeout=OLLAMA_EJECT_SECONDS,
+    health_interval=OLLAMA_HEALTH_INTERVAL_SECONDS,
+    hedge_delay=OLLAMA_HEDGE_DELAY_SECONDS,
+    keep_alive=OLLAMA_KEEP_ALIVE
+)
+
+# Loads the model and primes the default product's prompt before the first buyer, then keeps it loaded
+default_product = catalog.get(DEFAULT_SKU)
+warmer = ModelWarmer(
+    ollama,
+    MODEL,
+    OLLAMA_KEEP_ALIVE,
+    prime_messages=[default_product.system_message] if default_product is not None else [],
+    interval=WARMUP_INTERVAL_SECONDS,
+    timeout=OLLAMA_TIMEOUT_SECONDS,
+    retry_interval=WARMUP_RETRY_SECONDS
+)
+
+# How many buyer messages the rule-based fast path handled without the LLM
+fast_path_stats = fast_path.FastPathStats()
+
+# Classification, extraction and rephrasing answers, keyed by a hash of the full request
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL_SECONDS,
+    db_path=RESPONSE_CACHE_DB_PATH,
+    namespace=MODEL
+)
+
+# Varied renderings of the closing messages, served without an LLM round trip
+phrasing_pool = PhrasingPool(PHRASING_POOL_PATH, MODEL, variants=PHRASING_VARIANTS, max_age=PHRASING_MAX_AGE_SECONDS)
+
+async def get_ollama_response(session, user_message, relay=None):
+    """
+    Negotiate one turn of the conversation.
+    If a TokenRelay is given, the assistant's reply is streamed into it as Ollama generates it.
+    """
+    if session.closed:
+        if relay is not None:
+            relay.close()  # No reply is coming, so a streaming client mustn't wait for one
         return {
             'response': "The negotiation has ended. No more offers can be made.",
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'last_negotiated_price': session.last_price,
             'show_buttons': False
         }
 
-    logging.info(f"last negotiated price: {LAST_NEGOTIATED_PRICE}")
-    conversation_history.append({"role": "user", "content": user_message})
-    user_offer = extract_price_from_message(user_message, 'user')
-
-    # Classify user's intent before generating assistant's response
-    user_intent = classify_user_intent(user_message)
+    metrics.inc('turns_total')
+    turn_started = time.perf_counter()
+    logging.info(f"last negotiated price: {session.last_price}")
+    history_length, offers_length = len(session.history), len(session.offers)
+    session.history.append({"role": "user", "content": user_message})
+
+    # The counteroffer only depends on earlier turns, so it is known before the user's message is analyzed
+    policy = concession_policy(session.product.min_price)
+    opening = session.opening_price if session.opening_price is not None else session.product.list_price
+    counter = policy.counter(opening, session.attempts, best_user_offer(session))
+
+    # Every LLM call of the turn, the speculative reply included, shares one deadline
+    with scheduler.deadline(TURN_DEADLINE_SECONDS):
+        # The assistant's reply doesn't depend on the analysis of the user's message, so
+        # request it straight away; it is cancelled if the analysis ends the negotiation.
+        chat_task = None
+        if session.attempts < MAX_ATTEMPTS:
+            payload = {
+                "model": MODEL,
+                "stream": False,
+                "messages": build_chat_messages(session, counter)
+            }
+            if relay is None:
+                chat_task = asyncio.create_task(timed_chat('chat', payload, priority=PRIORITY_CHAT))
+            else:
+                chat_task = asyncio.create_task(stream_chat(payload, relay))
+        try:
+            response = await negotiate_turn(session, user_message, chat_task, counter, relay)
+        except SchedulerRejected as e:
+            # Nothing was decided, so leave the session as it was for the buyer to try again
+            logging.warning(f"Turn rejected by the scheduler: {e}")
+            metrics.inc('turns_rejected_total')
+            del session.history[history_length:]
+            del session.offers[offers_length:]
+            response = busy_response(session)
+        finally:
+            # Queued even if the turn was cancelled. The reply doesn't wait for the write: the writer starts on it
+            # at once, and should the buyer's next turn beat it to another worker, the compare-and-set keeps
+            # whichever turn is written first and that worker drops the other
+            sessions.save(session)
+            metrics.observe('turn_duration_seconds', time.perf_counter() - turn_started)
+            if chat_task is not None:
+                discard_task(chat_task)
+            if relay is not None:
+                relay.close()
+
+    return response
+
+async def stream_chat(payload, relay):
+    """
+    Stream a chat response into `relay`, returning it assembled in the same shape as a non-streamed response.
+    """
+    content = []
+    final_chunk = {}
+    try:
+        with metrics.span('chat') as span:
+            async for chunk in ollama.chat_stream(payload, priority=PRIORITY_CHAT):
+                token = chunk.get('message', {}).get('content', '')
+                if token:
+                    content.append(token)
+                    relay.put(token)
+                if chunk.get('done'):
+                    final_chunk = chunk
+            span.record(final_chunk)
+    finally:
+        relay.close()
+    return {**final_chunk, 'message': {'role': 'assistant', 'content': ''.join(content)}}
+
+async def negotiate_turn(session, user_message, chat_task, counter, relay=None):
+    """
+    Decide the outcome of the user's message.
+    `chat_task` is the pending assistant reply offering `counter`, awaited only if the negotiation carries on.
+    """
+    user_intent, user_offer = await analyze_message(user_message)
     logging.info(f"User intent: {user_intent}")
+    if user_offer is not None:
+        session.offers.append(('user', user_offer))
 
     # Handle user's acceptance or rejection before calling the assistant's response
     if user_intent == "acceptance":
-        negotiation_closed = True
-        bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-        logging.info(f"Finalized negotiation with price: {LAST_NEGOTIATED_PRICE}")
+        session.closed = True
+        bot_message = finalize_negotiation(session, session.last_price, close_offer=True)
+        logging.info(f"Finalized negotiation with price: {session.last_price}")
         return {
-            'response': generate_natural_response(bot_message),
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'response': bot_message,
+            'last_negotiated_price': session.last_price,
             'show_buttons': False
         }
     elif user_intent == "rejection":
-        negotiation_closed = True
-        bot_message = "Sorry that we couldn't reach an agreement. Better luck next time!"
+        session.closed = True
+        metrics.inc('rejections_total')
+        bot_message = phrasing_pool.render('rejection')
         return {
-            'response': generate_natural_response(bot_message),
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'response': bot_message,
+            'last_negotiated_price': session.last_price,
             'show_buttons': False
         }
 
-    negotiator_price = LAST_NEGOTIATED_PRICE if LAST_NEGOTIATED_PRICE is not None else ACTUAL_PRICE
+    negotiator_price = session.last_price if session.last_price is not None else session.product.list_price
 
     # Check if the user's offer is acceptable
-    if user_offer is not None and negotiator_price is not None:
-        if abs(user_offer - negotiator_price) <= (0.02 * negotiator_price):
-            LAST_NEGOTIATED_PRICE = user_offer
-            negotiation_closed = True
-            bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-            logging.info(f"User's offer accepted: {LAST_NEGOTIATED_PRICE}")
-            return {
-                'response': generate_natural_response(bot_message),
-                'last_negotiated_price': LAST_NEGOTIATED_PRICE,
-                'show_buttons': False
-            }
+    if concession_policy(session.product.min_price).accepts(user_offer, counter):
+        session.last_price = user_offer
+        session.closed = True
+        bot_message = finalize_negotiation(session, session.last_price, close_offer=True)
+        logging.info(f"User's offer accepted: {session.last_price}")
+        return {
+            'response': bot_message,
+            'last_negotiated_price': session.last_price,
+            'show_buttons': False
+        }
 
-    if negotiation_attempts >= MAX_ATTEMPTS:
-        negotiation_closed = True  # Close the negotiation
-        bot_message = generate_natural_response(
-            f"We've reached the maximum negotiation attempts. Our final price is {negotiator_price} {CURRENCY}."
-        )
+    if session.attempts >= MAX_ATTEMPTS:
+        session.closed = True  # Close the negotiation
+        metrics.inc('attempts_exhausted_total')
+        bot_message = phrasing_pool.render('max_attempts', price=format_amount(negotiator_price))
         return {
             'response': bot_message,
             'last_negotiated_price': negotiator_price,
             'show_buttons': True
         }
 
-    # Proceed to generate assistant's response
+    # Proceed with the assistant's response requested at the start of the turn
+    if relay is not None:
+        relay.release()  # The reply is going to be used, so start showing it
     try:
-        payload = {
-            "model": MODEL,
-            "stream": False,
-            "messages": conversation_history
-        }
-        response = requests.post(OLLAMA_API_URL, json=payload)
-        response.raise_for_status()
-        bot_response = response.json()
+        bot_response = await chat_task
 
         bot_message = bot_response['message']['content'].strip()
         logging.info(f"Bot's message: {bot_message}")
-        logging.info(f"Bot's response: {bot_response}")
-        bot_price = extract_price_from_message(bot_message, 'assistant')
-        logging.info(f"Price extracted from bot response: {bot_price}")
-
-        conversation_history.append({"role": "assistant", "content": bot_message})
-
-        # Classify assistant's intent
-        assistant_intent = classify_assistant_intent(bot_message)
-        logging.info(f"Assistant intent: {assistant_intent}")
-
-        # Update LAST_NEGOTIATED_PRICE if bot provided a new price
-        if bot_price is not None:
-            LAST_NEGOTIATED_PRICE = bot_price
-            logging.info(f"Updated LAST_NEGOTIATED_PRICE to {LAST_NEGOTIATED_PRICE}")
-            
-        if user_offer is not None:
-            if abs(user_offer - negotiator_price) <= (0.02 * negotiator_price):
-                LAST_NEGOTIATED_PRICE = user_offer
-                negotiation_closed = True
-                bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-                logging.info(f"User's offer accepted: {LAST_NEGOTIATED_PRICE}")
-                return {
-                    'response': generate_natural_response(bot_message),
-                    'last_negotiated_price': LAST_NEGOTIATED_PRICE,
-                    'show_buttons': False
-                }
-
-        # Handle assistant's acceptance
-        if assistant_intent == "acceptance":
-            negotiation_closed = True
-            bot_message = finalize_negotiation(LAST_NEGOTIATED_PRICE, close_offer=True)
-            logging.info(f"Finalized negotiation with price: {LAST_NEGOTIATED_PRICE}")
-            return {
-                'response': generate_natural_response(bot_message),
-                'last_negotiated_price': LAST_NEGOTIATED_PRICE,
-                'show_buttons': False
-            }
+        logging.info(f"Prompt eval tokens: {bot_response.get('prompt_eval_count')}")
+        log_payload("Bot's response", bot_response)
+
+        session.history.append({"role": "assistant", "content": bot_message})
 
-        negotiation_attempts += 1
+        # The reply was told to offer the counteroffer, so there is no need to read the price back out of it
+        session.last_price = counter
+        session.offers.append(('assistant', counter))
+        logging.info(f"Updated last negotiated price to {session.last_price}")
+
+        session.attempts += 1
         return {
             'response': bot_message,
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'last_negotiated_price': session.last_price,
             'show_buttons': False
         }
+    except SchedulerRejected:
+        raise
     except Exception as e:
         logging.error(f"Error connecting to Ollama API: {e}")
         return {
             'response': "Sorry, something went wrong!",
-            'last_negotiated_price': LAST_NEGOTIATED_PRICE,
+            'last_negotiated_price': session.last_price,
             'show_buttons': False
         }
 
-def extract_price_from_message(message, speaker):
+def log_payload(label, payload):
+    """Log a full Ollama payload for a sample of calls, only formatting it if it will be emitted."""
+    if logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < PAYLOAD_LOG_SAMPLE_RATE:
+        logging.debug("%s: %s", label, payload)
+
+def busy_response(session):
+    """The response for a turn turned away because Ollama is too busy; the buyer can simply resend."""
+    return {
+        'response': "Sorry, we're very busy right now. Please send that again in a moment.",
+        'last_negotiated_price': session.last_price if session is not None else None,
+        'show_buttons': False,
+        'busy': True
+    }
+
+async def timed_chat(call_site, payload, timeout=None, priority=PRIORITY_AUX):
     """
-    Extract the most relevant price from the message using the Ollama API.
+    Send a chat request, recording a span for `call_site`.
     """
-    logging.info(f"Extracting price from message from {speaker}: {message}")
+    with metrics.span(call_site) as span:
+        response_data = await ollama.chat(payload, timeout=timeout, priority=priority)
+        span.record(response_data)
+        return response_data
 
-    if speaker == 'user':
-        system_prompt = (
-            "You are an assistant that extracts the latest price offered or suggested by the user in a negotiation message. "
-            "Given the user's message, identify the latest price offered or suggested by the user. "
-            "Respond with only the numerical value of that price. "
-            "Do not include any additional text, currency symbols, or other numbers. If there is no price mentioned, respond with 'No price found'."
-        )
-    elif speaker == 'assistant':
-        system_prompt = (
-            "You are an assistant that extracts the latest price offered or suggested by the assistant in a negotiation message. "
-            "Given the assistant's message, identify the latest price offered or suggested by the assistant. "
-            "Respond with only the numerical value of that price. "
-            "Do not include any additional text, currency symbols, or other numbers. If there is no price mentioned, respond with 'No price found'."
+async def cached_chat(call_site, payload, timeout=None, priority=PRIORITY_AUX):
+    """
+    Send a chat request whose answer depends only on its payload, serving repeats from the response cache.
+    """
+    with metrics.span(call_site) as span:
+        key = ResponseCache.key(payload)
+        cached = await response_cache.fetch(key)
+        if cached is not None:
+            span.outcome = 'cached'
+            return cached
+        # Cheap and idempotent, so a slow call can safely be raced against a second server
+        response_data = await ollama.chat(payload, timeout=timeout, priority=priority, hedge=True)
+        span.record(response_data)
+    response_cache.set(key, {'message': response_data.get('message', {})})
+    return response_data
+
+INTENTS = ("acceptance", "rejection", "negotiation", "unknown")
+
+# JSON schema Ollama constrains the turn analysis output to
+TURN_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": list(INTENTS)},
+        "price": {"type": ["number", "null"]}
+    },
+    "required": ["intent", "price"]
+}
+
+async def analyze_message(message):
+    """
+    Classify the intent of the user's negotiation message and extract its latest price in a single call.
+    Returns an (intent, price) tuple, where price is None if no price was mentioned.
+    Falls back to the separate classification and extraction prompts if the response is malformed.
+    """
+    # Most buyer messages are a bare offer or a yes/no, which don't need the LLM
+    fast_result = fast_path.analyze(message)
+    hit = fast_result.confidence >= FAST_PATH_MIN_CONFIDENCE
+    fast_path_stats.record(hit)
+    if hit:
+        logging.info(f"Fast path analysis for user: intent={fast_result.intent}, price={fast_result.price}")
+        return fast_result.intent, fast_result.price
+
+    logging.info("Analyzing message from user.")
+
+    system_prompt = (
+        "You are an assistant that analyzes the user's latest message in a price negotiation. "
+        "Respond with a JSON object with two fields, 'intent' and 'price'.\n\n"
+        "Guidelines for 'intent':\n"
+        "- If the user agrees to the price or says phrases like 'Yes', 'sure', 'Deal', use 'acceptance'.\n"
+        "- If the user declines or says phrases like 'No', 'Not interested', 'I don't think so', use 'rejection'.\n"
+        "- If the user makes a counteroffer (gives a price) or continues negotiating, use 'negotiation'.\n"
+        "- If the intent is unclear, use 'unknown'.\n\n"
+        "Guidelines for 'price':\n"
+        "- The numerical value of the latest price offered or suggested by the user, without currency symbols.\n"
+        "- If there is no price mentioned, use null."
+    )
+
+    payload = {
+        "model": MODEL,
+        "stream": False,
+        "format": TURN_ANALYSIS_SCHEMA,
+        "options": {"temperature": 0},
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ]
+    }
+
+    try:
+        response_data = await cached_chat("analysis/user", payload, timeout=OLLAMA_AUX_TIMEOUT_SECONDS)
+    except SchedulerRejected:
+        raise
+    except Exception as e:
+        logging.error(f"Error analyzing message with Ollama API: {e}")
+        return "unknown", None
+
+    content = response_data.get('message', {}).get('content', '')
+    try:
+        intent, price = parse_turn_analysis(content)
+    except ValueError as e:
+        logging.warning(f"Malformed turn analysis ({e}), falling back to separate prompts: {content!r}")
+        price, intent = await asyncio.gather(
+            extract_price_from_message(message),
+            classify_user_intent(message)
         )
-    else:
-        logging.error("Invalid speaker specified.")
-        return None
+    logging.info(f"Turn analysis for user: intent={intent}, price={price}")
+    return intent, price
+
+def parse_turn_analysis(content):
+    """
+    Validate a turn analysis response against TURN_ANALYSIS_SCHEMA.
+    Raises ValueError if it doesn't conform.
+    """
+    data = json.loads(content)  # json.JSONDecodeError is a ValueError
+    if not isinstance(data, dict) or set(data) != {"intent", "price"}:
+        raise ValueError("expected an object with exactly 'intent' and 'price'")
+
+    intent = data["intent"]
+    if intent not in INTENTS:
+        raise ValueError(f"unexpected intent {intent!r}")
+
+    price = data["price"]
+    if price is not None:
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or not math.isfinite(price) or price <= 0:
+            raise ValueError(f"invalid price {price!r}")
+        price = float(price)
+    return intent, price
+
+async def extract_price_from_message(message):
+    """
+    Extract the most relevant price from the user's message using the Ollama API.
+    """
+    logging.info(f"Extracting price from message from user: {message}")
+
+    system_prompt = (
+        "You are an assistant that extracts the latest price offered or suggested by the user in a negotiation message. "
+        "Given the user's message, identify the latest price offered or suggested by the user. "
+        "Respond with only the numerical value of that price. "
+        "Do not include any additional text, currency symbols, or other numbers. If there is no price mentioned, respond with 'No price found'."
+    )
 
     payload = {
         "model": MODEL,
@@ -193,10 +501,8 @@ def extract_price_from_message(message, speaker):
     }
 
     try:
-        response = requests.post(OLLAMA_API_URL, json=payload)
-        response.raise_for_status()
-        response_data = response.json()
-        logging.info(f"Ollama API response in extract_price_from_message: {response_data}")
+        response_data = await cached_chat("extract_price/user", payload, timeout=OLLAMA_AUX_TIMEOUT_SECONDS)
+        log_payload("Ollama API response in extract_price_from_message", response_data)
 
         extracted_text = response_data.get('message', {}).get('content', '').strip()
         logging.info(f"Extracted text: {extracted_text}")
@@ -231,20 +537,21 @@ def extract_price_from_message(message, speaker):
         logging.error(f"Error extracting price using Ollama API: {e}", exc_info=True)
         return None
 
-def finalize_negotiation(last_price, close_offer=False):
+def finalize_negotiation(session, last_price, close_offer=False):
     """
     Finalizes the negotiation process.
     """
     if close_offer:
+        metrics.inc('deals_closed_total')
         discount_code = generate_random_code()
-        bot_message = f"Deal closed! We've accepted your offer of {last_price} {CURRENCY}. Here's your discount code: {discount_code}. Thank you for negotiating with us!"
+        bot_message = phrasing_pool.render('deal_closed', price=format_amount(last_price), discount_code=discount_code)
     else:
         bot_message = "No deal reached. Thank you for your time!"
 
-    reset_conversation()
+    reset_conversation(session)
     return bot_message
 
-def classify_user_intent(user_message):
+async def classify_user_intent(user_message):
     """
     Classify the user's intent based on their latest message.
     """
@@ -274,9 +581,7 @@ def classify_user_intent(user_message):
     }
 
     try:
-        response = requests.post(OLLAMA_API_URL, json=payload)
-        response.raise_for_status()
-        bot_response = response.json()
+        bot_response = await cached_chat('classify_user_intent', payload, timeout=OLLAMA_AUX_TIMEOUT_SECONDS)
 
         # Extract the intent from the response
         response_content = bot_response.get('message', {}).get('content', '').strip().lower()
@@ -294,104 +599,262 @@ def classify_user_intent(user_message):
         logging.error(f"Error classifying user intent with Ollama API: {e}")
         return "unknown"
 
-def classify_assistant_intent(bot_message):
+def build_facts_message(session, counter):
     """
-    Classify the assistant's intent based on their latest message.
+    Build the compact per-session facts that follow the conversation, ending with the price to offer.
+    Older turns may have dropped out of the history window, so the latest offers are listed here.
     """
-    logging.info(f"Classifying assistant intent based on assistant message.")
+    facts = []
+    if session.offers:
+        offers = ", ".join(
+            f"{'user' if role == 'user' else 'you'} {format_amount(price)}"
+            for role, price in session.offers[-MAX_OFFERS_IN_FACTS:]
+        )
+        facts.append(f"Offers so far: {offers}.")
+    facts.append(f"Price to offer now: {format_amount(counter)}.")
+    return {"role": "system", "content": "Negotiation facts: " + " ".join(facts)}
 
-    conversation = [
-        {
-            "role": "system",
-            "content": (
-                "You are an assistant that classifies the assistant's intent in a price negotiation. "
-                "Given the assistant's latest message, classify the intent as 'acceptance', 'rejection', or 'negotiation'. "
-                "Only respond with the intent.\n\n"
-                "Guidelines:\n"
-                "- If the assistant accepts the user's offer or says phrases like 'Deal', 'Agreed', 'ok', 'alright', 'We have a deal', classify as 'acceptance'.\n"
-                "- If the assistant declines the negotiation or says phrases like 'We cannot offer a better price', 'Sorry, that's our final offer', classify as 'rejection'.\n"
-                "- If the assistant makes a counteroffer, suggests a new price, continues negotiating, or asks the user what it thinks then classify as 'negotiation'.\n"
-                "- If the intent is unclear, classify as 'unknown'."
-            )
-        },
-        {"role": "user", "content": bot_message}
-    ]
+def build_chat_messages(session, counter):
+    """
+    Assemble the negotiation prompt: the static system prefix, a token-budgeted window of
+    recent turns, then the session facts with the counteroffer to phrase.
+    """
+    return (
+        [session.product.system_message]
+        + window_history(session.history, HISTORY_TOKEN_BUDGET)
+        + [build_facts_message(session, counter)]
+    )
+
+def best_user_offer(session):
+    """The highest price the user has offered so far, or None."""
+    return max((price for role, price in session.offers if role == 'user'), default=None)
+
+async def initialize_ollama_response(session, user_message):
+    session.history.clear()
+    session.offers.clear()
+    session.attempts = 0
+    session.closed = False  # Reset negotiation closed flag
+    first_discounted_price = generate_random_discount(session.product.list_price)
+    session.opening_price = first_discounted_price
+    session.last_price = first_discounted_price  # **Set last_price to assistant's first offer**
+    return await get_ollama_response(session, user_message)
+ 
+def discard_task(task):
+    """Cancel a task whose result is no longer needed."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()  # Mark any error as retrieved so asyncio doesn't warn about it
 
-    payload = {
-        "model": MODEL,
-        "stream": False,
-        "messages": conversation
-    }
+def generate_random_code():
+    """Generates a random 6-digit discount code."""
+    return ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
+
+def reset_conversation(session):
+    """Reset the conversation history and negotiation attempts after a conversation ends."""
+    session.history.clear()
+    session.offers.clear()
+    session.attempts = 0
+    session.last_price = None  # **Reset last_price to None**
+
+async def handle_chatbot(data):
+    """
+    Handle a /chatbot request body, returning the response body and status code.
+    """
+    user_message = data['message']
+    session = await sessions.fetch(data.get('session_id'))
+    if session is None:
+        return {
+            'response': "Your negotiation session has expired. Please refresh the page to start a new one.",
+            'last_negotiated_price': None,
+            'show_buttons': False
+        }, 404
+    if ollama.overloaded():
+        metrics.inc('turns_rejected_total')
+        return busy_response(session), 503
+    bot_response = await get_ollama_response(session, user_message)
+    return bot_response, 503 if bot_response.get('busy') else 200
+
+async def handle_initialize(data):
+    """
+    Handle an /initialize request body, returning the response body and status code.
+    """
+    user_message = data['message']
+    product = await catalog.fetch(data.get('sku') or DEFAULT_SKU)
+    if product is None:
+        return {
+            'response': "Sorry, we couldn't find that product.",
+            'last_negotiated_price': None,
+            'show_buttons': False
+        }, 404
+    if ollama.overloaded():
+        metrics.inc('turns_rejected_total')
+        return busy_response(None), 503
+    phrasing_pool.refresh_in_background(generate_phrasing_variant)  # No-op unless the pool is stale
+    sessions.discard(data.get('session_id'))  # Restarting abandons any previous negotiation
+    session = sessions.create()
+    session.product = product
+    bot_response = await initialize_ollama_response(session, user_message)  # Adjust to initialize with Ollama
+    bot_response['session_id'] = session.session_id
+    bot_response['sku'] = product.sku
+    return bot_response, 503 if bot_response.get('busy') else 200
+
+async def handle_chatbot_stream(data):
+    """
+    Handle a /chatbot/stream request body.
+    Returns an async generator of server-sent events, or an error body, along with the status code.
+    """
+    session = await sessions.fetch(data.get('session_id'))
+    if session is None:
+        return {
+            'response': "Your negotiation session has expired. Please refresh the page to start a new one.",
+            'last_negotiated_price': None,
+            'show_buttons': False
+        }, 404
+    if ollama.overloaded():
+        metrics.inc('turns_rejected_total')
+        return busy_response(session), 503
+    return stream_ollama_response(session, data['message']), 200
 
+async def stream_ollama_response(session, user_message):
+    """
+    Negotiate one turn, yielding 'token' events as the reply is generated and a trailing 'done' event
+    carrying the same fields as a /chatbot response.
+    """
+    relay = TokenRelay()
+    turn_task = asyncio.create_task(get_ollama_response(session, user_message, relay=relay))
+    turn_task.add_done_callback(lambda _: relay.close())  # However the turn ends, stop waiting for tokens
     try:
-        response = requests.post(OLLAMA_API_URL, json=payload)
-        response.raise_for_status()
-        bot_response = response.json()
+        async for token in relay:
+            yield sse_event('token', {'token': token})
+        yield sse_event('done', await turn_task)
+    finally:
+        discard_task(turn_task)  # Stops the turn if the client went away mid-stream
 
-        # Extract the intent from the response
-        response_content = bot_response.get('message', {}).get('content', '').strip().lower()
-        logging.info(f'Assistant intent is {response_content}')
-        # Map the response to predefined intents
-        if "acceptance" in response_content:
-            return "acceptance"
-        elif "rejection" in response_content:
-            return "rejection"
-        elif "negotiation" in response_content:
-            return "negotiation"
+async def handle_stats():
+    """
+    Return counters describing how much LLM work the service is avoiding.
+    """
+    return {
+        'fast_path': fast_path_stats.snapshot(),
+        'response_cache': response_cache.snapshot(),
+        'scheduler': ollama.scheduler_snapshot(),
+        'ollama': ollama.backends_snapshot(),
+        'catalog': catalog.snapshot(),
+        'sessions': sessions.snapshot()
+    }, 200
+
+def export_snapshot(prefix, snapshot, counters):
+    """
+    Export a component's snapshot: the running totals named in `counters` as `_total` counters, the rest as gauges.
+    """
+    for name, value in snapshot.items():
+        if name in counters:
+            metrics.set_counter(f"{prefix}_{name}_total", value)
         else:
-            return "unknown"
-    except Exception as e:
-        logging.error(f"Error classifying assistant intent with Ollama API: {e}")
-        return "unknown"
+            metrics.set_gauge(f"{prefix}_{name}", value)
 
-def initialize_ollama_response(user_message):
-    global negotiation_attempts, LAST_NEGOTIATED_PRICE, negotiation_closed
-    conversation_history.clear()
-    negotiation_attempts = 0
-    negotiation_closed = False  # Reset negotiation closed flag
-    first_discounted_price = generate_random_discount(ACTUAL_PRICE)
-    LAST_NEGOTIATED_PRICE = first_discounted_price  # **Set LAST_NEGOTIATED_PRICE to assistant's first offer**
-    conversation_history.append({
-        "role": "system",
-        "content": (
-            f"You are a friendly and suave British price negotiator working for {COMPANY_NAME}. "
-            f"You are selling a set of 4 wheels for {ACTUAL_PRICE} {CURRENCY}. "
-            f"Start by always offering a price of {first_discounted_price} {CURRENCY} first. "
-            f"You should negotiate down to no less than {MIN_PRICE} {CURRENCY} after multiple attempts. "
-            f"If the user's offer is less than 50% of {ACTUAL_PRICE} {CURRENCY} tell them that we won't have a deal with this kind of offer so please try to do better. "
-            "The user can offer up to 5 times. If the user's offer is within 10% of your price, immediately accept. "
-            "Go a bit lower the next time you offer a price. Don't mention the price that the user offered. "
-            "Never go below the price that the user offered. "
-            "Always offer the price in the format '£<price>' or '<price> GBP' and don't mention the discount amount. "
-            "If the user accepts your price, just accept it."
-        )
+async def handle_metrics():
+    """
+    Return the metrics in the Prometheus text format.
+    """
+    export_snapshot('fast_path', fast_path_stats.snapshot(), counters={'hits', 'misses', 'llm_calls_saved'})
+    export_snapshot('response_cache', response_cache.snapshot(), counters={'hits', 'memory_hits', 'disk_hits', 'misses'})
+    export_snapshot('catalog', catalog.snapshot(), counters={'hits', 'loads'})
+    export_snapshot('scheduler', ollama.scheduler_snapshot(),
+                    counters={'admitted', 'rejected_queue_full', 'rejected_deadline'})
+    backends = ollama.backends_snapshot()
+    for url, backend in backends['backends'].items():
+        metrics.set_gauge('backend_outstanding', backend['outstanding'], backend=url)
+        metrics.set_counter('backend_requests_total', backend['requests'], backend=url)
+        metrics.set_counter('backend_failures_total', backend['failures'], backend=url)
+        metrics.set_gauge('backend_up', int(backend['state'] == 'closed'), backend=url)
+    metrics.set_counter('hedges_sent_total', backends['hedges_sent'])
+    metrics.set_counter('hedges_won_total', backends['hedges_won'])
+    export_snapshot('sessions', sessions.snapshot(), counters={
+        'disk_loads', 'stale_reloads', 'flushes', 'rows_written', 'conflicts', 'flush_errors', 'compacted'
     })
-    return get_ollama_response(user_message)
- 
-def generate_random_code():
-    """Generates a random 6-digit discount code."""
-    return ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
+    return metrics.render(), 200
 
-def reset_conversation():
-    """Reset the conversation history and negotiation attempts after a conversation ends."""
-    global conversation_history, negotiation_attempts, LAST_NEGOTIATED_PRICE
-    conversation_history.clear()
-    negotiation_attempts = 0
-    LAST_NEGOTIATED_PRICE = None  # **Reset LAST_NEGOTIATED_PRICE to None**
+async def handle_ready():
+    """
+    Report whether the model is loaded and ready to negotiate, with 503 until it is.
+    """
+    return {
+        'ready': warmer.ready,
+        'backends': warmer.snapshot()
+    }, 200 if warmer.ready else 503
+
+async def start_background_work():
+    """Warm the model, then regenerate the phrasing pool if it is stale, so the first buyer doesn't wait on either."""
+    await warmer.start()
+    phrasing_pool.refresh_in_background(generate_phrasing_variant)  # No-op unless the pool is stale
+
+_warmup_lock = threading.Lock()
+_warmup_pid = None
+
+def start_warmup(wait=True):
+    """
+    Warm the model for the Flask app, then keep it warm from the background loop. Without `wait`, returns
+    once the warm-up has started. Runs once per process, as each worker of a preforking server has its
+    own loop. The ASGI app does the same in its lifespan startup.
+    """
+    global _warmup_pid
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return
+        _warmup_pid = os.getpid()
+    started = asyncio.run_coroutine_threadsafe(start_background_work(), get_loop())
+    if wait:
+        started.result()
+
+def warm_forked_worker():
+    # Threads don't survive a fork, so a worker forked from a preloaded app starts its own right away
+    global _warmup_lock
+    if not WARM_AFTER_FORK:
+        return
+    _warmup_lock = threading.Lock()  # Another thread may have held the parent's copy at the fork
+    start_warmup(wait=False)
+
+os.register_at_fork(after_in_child=warm_forked_worker)
+
+@app.before_request
+def start_worker():
+    # For servers that import the app in each worker after forking and nowhere else
+    start_warmup(wait=False)
 
 @app.route('/chatbot', methods=['POST'])
 def chatbot_response():
-    data = request.get_json()
-    user_message = data['message']
-    bot_response = get_ollama_response(user_message)
-    return jsonify(bot_response)
+    bot_response, status = run_sync(handle_chatbot(request.get_json()))
+    return jsonify(bot_response), status
 
 @app.route('/initialize', methods=['POST'])
 def chatbot_initialize():
-    data = request.get_json()
-    user_message = data['message']
-    bot_response = initialize_ollama_response(user_message)  # Adjust to initialize with Ollama
-    return jsonify(bot_response)
+    bot_response, status = run_sync(handle_initialize(request.get_json()))
+    return jsonify(bot_response), status
+
+@app.route('/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    body, status = run_sync(handle_chatbot_stream(request.get_json()))
+    if isinstance(body, dict):
+        return jsonify(body), status
+    return Response(iterate_sync(body), status=status, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    body, status = run_sync(handle_metrics())
+    return Response(body, status=status, mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    body, status = run_sync(handle_ready())
+    return jsonify(body), status
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    body, status = run_sync(handle_stats())
+    return jsonify(body), status
 
 def generate_random_discount(original_price):
     discount_percentage = random.uniform(2, 5)
@@ -399,34 +862,31 @@ def generate_random_discount(original_price):
     discounted_price = original_price * (1 - discount / 100)
     return round(discounted_price, 2)  # **Ensure the price is rounded to two decimal places**
   
-def generate_natural_response(prompt):
+async def generate_phrasing_variant(template):
     """
-    Send a prompt to the Ollama API and return a natural-sounding response.
+    Ask the Ollama API for one natural-sounding rewording of a phrasing pool template.
+    Placeholders in curly braces are kept so the rewording can be filled in later.
     """
     payload = {
         "model": MODEL,
         "stream": False,
+        "options": {"temperature": 0.9},  # Each call should come up with a different wording
         "messages": [
             {
                 "role": "user",
-                "content": f"Output the following sentence as something a human would say without adding sentences that might change the meaning: {prompt}"
+                "content": (
+                    "Output the following sentence as something a human would say without adding sentences that might change the meaning. "
+                    "Keep every placeholder in curly braces, such as {price}, exactly as written, and respond with the sentence only: "
+                    f"{template}"
+                )
             }
         ]
     }
-    
-    try:
-        response = requests.post(OLLAMA_API_URL, json=payload)
-        response.raise_for_status()  # Raise an error for bad responses
 
-        # Extract the content from the response
-        response_data = response.json()
-        natural_response = response_data.get('message', {}).get('content', '').strip()
-        logging.info(f"Ollama API response in generate_natural_response: {response_data}")
-        return natural_response
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error connecting to Ollama API: {e}")
-        return "Sorry, I couldn't process your request."
+    # Errors propagate so a failed call never ends up in the pool
+    response_data = await timed_chat('phrasing', payload, timeout=OLLAMA_AUX_TIMEOUT_SECONDS, priority=PRIORITY_BACKGROUND)
+    return response_data.get('message', {}).get('content', '').strip().strip('"')
 
 if __name__ == '__main__':
+    start_warmup()
     app.run(debug=True)
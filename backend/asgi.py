@@ -0,0 +1,115 @@
+"""
+ASGI entry point for the negotiator.
+
+Serves the same endpoints as the Flask app, but natively on the server's
+event loop, so a negotiation waiting on Ollama costs a coroutine rather than a
+worker thread. Run it with, for example:
+
+    uvicorn asgi:application --app-dir backend
+"""
+import json
+import logging
+
+import app as negotiator
+
+negotiator.WARM_AFTER_FORK = False  # Each worker warms up in its lifespan startup, on its own loop
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+
+# path -> (method, handler); POST handlers receive the decoded JSON body
+ROUTES = {
+    '/chatbot': ('POST', negotiator.handle_chatbot),
+    '/chatbot/stream': ('POST', negotiator.handle_chatbot_stream),
+    '/initialize': ('POST', negotiator.handle_initialize),
+    '/metrics': ('GET', negotiator.handle_metrics),
+    '/ready': ('GET', negotiator.handle_ready),
+    '/stats': ('GET', negotiator.handle_stats),
+}
+
+async def read_json(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return json.loads(body or b'{}')
+
+async def send_response(send, status, body=b'', content_type=b'application/json'):
+    headers = [(b'content-type', content_type), (b'content-length', str(len(body)).encode())] + CORS_HEADERS
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, data, status=200):
+    await send_response(send, status, json.dumps(data).encode('utf-8'))
+
+async def send_event_stream(send, events, status=200):
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ] + CORS_HEADERS
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    try:
+        async for event in events:
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    finally:
+        await events.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await negotiator.start_background_work()  # Only accept buyers once the model is loaded, or has failed to load
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            negotiator.warmer.stop()
+            await negotiator.ollama.aclose()
+            negotiator.sessions.close()  # Write out sessions still queued
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    route = ROUTES.get(scope['path'])
+    if route is None:
+        await send_json(send, {'error': 'Not found'}, 404)
+        return
+    method, handler = route
+    if scope['method'] == 'OPTIONS':
+        await send_response(send, 204)
+        return
+    if scope['method'] != method:
+        await send_json(send, {'error': 'Method not allowed'}, 405)
+        return
+
+    args = []
+    if method == 'POST':
+        try:
+            args.append(await read_json(receive))
+        except ValueError:
+            await send_json(send, {'error': 'Invalid JSON body'}, 400)
+            return
+
+    try:
+        body, status = await handler(*args)
+    except Exception as e:
+        logging.error(f"Error handling {scope['path']}: {e}", exc_info=True)
+        await send_json(send, {'error': 'Internal server error'}, 500)
+        return
+    if isinstance(body, dict):
+        await send_json(send, body, status)
+    elif isinstance(body, str):
+        await send_response(send, status, body.encode('utf-8'), b'text/plain; version=0.0.4')
+    else:
+        await send_event_stream(send, body, status)
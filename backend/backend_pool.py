@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import random
+import time
+
+import httpx
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class NoBackendAvailable(Exception):
+    """Every Ollama backend is ejected by its circuit breaker."""
+
+
+def is_server_fault(error, cut_short=False):
+    """
+    Whether `error` says the server is unhealthy: a 5xx, a failed connection or a timeout at full length.
+    A 4xx is the request's fault, and a timeout `cut_short` by the turn's deadline the caller's.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    if isinstance(error, httpx.ConnectTimeout):
+        return True  # The connect timeout is never shortened
+    if isinstance(error, httpx.PoolTimeout):
+        return False  # Waited on this client's own connection pool, not the server
+    if isinstance(error, httpx.TimeoutException):
+        return not cut_short
+    return isinstance(error, httpx.NetworkError)
+
+
+class Backend:
+    """
+    One Ollama server and the state of its circuit breaker.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.health_url = str(httpx.URL(url).copy_with(path='/api/version', query=None))
+        self.outstanding = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_success = 0.0  # Monotonic time of the last call that succeeded
+
+
+class BackendPool:
+    """
+    Routes Ollama calls across several servers.
+
+    Each call goes to the available backend with the fewest requests
+    outstanding. A backend that fails `failure_threshold` calls in a row is
+    ejected for `reset_timeout` seconds, after which a single trial call is let
+    through (half-open): success puts it back in rotation, failure ejects it
+    again. Only errors that are the server's fault count towards ejection; see
+    is_server_fault. Health checks eject a backend that stops answering before
+    a buyer's call fails on it, but a passing check only makes an ejected
+    backend eligible for its trial call once `reset_timeout` is up: answering
+    /api/version doesn't mean /api/chat works, so only a chat call that
+    succeeds puts a backend back in rotation.
+
+    Not thread-safe; share it between event loops only if they never run at once.
+    """
+
+    def __init__(self, urls, failure_threshold=3, reset_timeout=15.0):
+        if not urls:
+            raise ValueError("At least one Ollama URL is required")
+        self.backends = [Backend(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def _available(self, backend, now):
+        if backend.state == OPEN and now - backend.opened_at >= self.reset_timeout:
+            backend.state = HALF_OPEN
+        if backend.state == HALF_OPEN:
+            return backend.outstanding == 0  # One trial call at a time
+        return backend.state == CLOSED
+
+    def in_rotation(self):
+        """How many backends are taking calls normally, not ejected or on trial."""
+        return sum(1 for backend in self.backends if backend.state == CLOSED)
+
+    def pick(self, exclude=()):
+        """
+        Return the available backend with the fewest outstanding requests, ties broken at random.
+        Raises NoBackendAvailable if there is none.
+        """
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and self._available(b, now)]
+        if not candidates:
+            raise NoBackendAvailable(f"No Ollama backend available out of {len(self.backends)}")
+        fewest = min(b.outstanding for b in candidates)
+        return random.choice([b for b in candidates if b.outstanding == fewest])
+
+    @contextlib.contextmanager
+    def track(self, backend, cut_short=False):
+        """
+        Count a call as outstanding on `backend` and feed its outcome to the circuit breaker.
+        `cut_short` says the call's timeout was shortened to fit the turn's deadline.
+        """
+        backend.outstanding += 1
+        backend.requests += 1
+        try:
+            yield
+        except httpx.HTTPError as e:
+            if is_server_fault(e, cut_short):
+                self.record_failure(backend)
+            raise
+        else:
+            self.record_success(backend)
+        finally:
+            backend.outstanding -= 1
+
+    def record_success(self, backend):
+        backend.last_success = time.monotonic()
+        backend.consecutive_failures = 0
+        backend.state = CLOSED
+
+    def record_failure(self, backend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.state == HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+            backend.state = OPEN
+            backend.opened_at = time.monotonic()
+
+    async def check_health(self, client, timeout=2.0):
+        """Probe every backend at once, ejecting unreachable ones and readying recovered ones for a trial call."""
+        await asyncio.gather(*(self._probe(client, backend, timeout) for backend in self.backends))
+
+    async def _probe(self, client, backend, timeout):
+        try:
+            response = await client.get(backend.health_url, timeout=timeout)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            if backend.state != OPEN:
+                backend.state = OPEN
+                backend.opened_at = time.monotonic()
+        else:
+            if backend.state == OPEN and time.monotonic() - backend.opened_at >= self.reset_timeout:
+                backend.state = HALF_OPEN
+
+    def snapshot(self):
+        return {
+            backend.url: {
+                'state': backend.state,
+                'outstanding': backend.outstanding,
+                'requests': backend.requests,
+                'failures': backend.failures,
+            }
+            for backend in self.backends
+        }
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import threading
+
+_loop = None
+_loop_pid = None  # A forked worker inherits the loop but not the thread running it
+_lock = threading.Lock()
+
+
+def get_loop():
+    """
+    Return the process-wide event loop, starting its thread on first use.
+
+    Synchronous (WSGI) request handlers hand their coroutines to this loop so
+    that every Ollama call in the process shares one pooled async client.
+    """
+    global _loop, _loop_pid
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='ollama-event-loop', daemon=True)
+            thread.start()
+            _loop = loop
+            _loop_pid = os.getpid()
+    return _loop
+
+
+def run_sync(coro, timeout=None):
+    """Run `coro` on the background loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def iterate_sync(agen):
+    """
+    Iterate an async generator on the background loop from synchronous code.
+    Closing the returned generator early closes `agen` as well.
+    """
+    async def next_item():
+        return await agen.__anext__()
+
+    try:
+        while True:
+            try:
+                yield run_sync(next_item())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_sync(agen.aclose())
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+
+class Product:
+    """
+    One negotiable catalog item, with its precompiled system prompt.
+    """
+    __slots__ = ('sku', 'name', 'description', 'list_price', 'min_price', 'system_message')
+
+    def __init__(self, sku, name, description, list_price, min_price):
+        if not 0 < min_price <= list_price:
+            raise ValueError(f"Product {sku}: min_price must be positive and at most list_price")
+        self.sku = sku
+        self.name = name
+        self.description = description
+        self.list_price = list_price
+        self.min_price = min_price
+        self.system_message = None
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            str(record['sku']),
+            record.get('name') or str(record['sku']),
+            record.get('description') or record.get('name') or str(record['sku']),
+            float(record['list_price']),
+            float(record['min_price'])
+        )
+
+
+class Catalog:
+    """
+    SKU-indexed product catalog, read on demand from a JSON Lines or SQLite file.
+
+    Nothing is read up front, so startup time doesn't grow with the catalog.
+    A SQLite file (.db, .sqlite, .sqlite3) is looked up by primary key. A JSON
+    Lines file is indexed incrementally: a lookup for a SKU not seen yet scans
+    on from where the last scan stopped, remembering every line's offset on
+    the way, so products appended to the file are found too. The `max_cached` most recently used products are kept in memory,
+    each with the system prompt `compile_prompt(product)` built for it when it
+    was loaded, so prompts are never rebuilt per request.
+    """
+
+    def __init__(self, path, compile_prompt=None, max_cached=4096):
+        self.path = path
+        self.compile_prompt = compile_prompt
+        self.max_cached = max_cached
+        self._cache = OrderedDict()  # sku -> Product, least recently used first
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None  # A connection mustn't be used across a fork, so each process opens its own
+        self._offsets = {}  # sku -> byte offset of its line, JSON Lines only
+        self._scanned_to = 0
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, sku):
+        """Return the Product for `sku`, or None if the catalog doesn't have it."""
+        if not sku:
+            return None
+        with self._lock:
+            product = self._cache.get(sku)
+            if product is not None:
+                self._cache.move_to_end(sku)
+                self.hits += 1
+                return product
+
+            record = self._read_sqlite(sku) if self.path.endswith(SQLITE_SUFFIXES) else self._read_jsonl(sku)
+            if record is None:
+                return None
+            product = Product.from_record(record)
+            if self.compile_prompt is not None:
+                product.system_message = self.compile_prompt(product)
+            self.loads += 1
+            self._cache[sku] = product
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+            return product
+
+    async def fetch(self, sku):
+        """`get` for async code: a cached product is returned inline, a file read runs on a worker thread."""
+        with self._lock:
+            product = self._cache.get(sku) if sku else None
+            if product is not None:
+                self._cache.move_to_end(sku)
+                self.hits += 1
+                return product
+        return await asyncio.to_thread(self.get, sku)
+
+    def _read_sqlite(self, sku):
+        if self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db_pid = os.getpid()
+        row = self._db.execute(
+            "SELECT sku, name, description, list_price, min_price FROM products WHERE sku = ?", (sku,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('sku', 'name', 'description', 'list_price', 'min_price'), row))
+
+    def _read_jsonl(self, sku):
+        with open(self.path, 'rb') as f:
+            offset = self._offsets.get(sku)
+            if offset is not None:
+                f.seek(offset)
+                return json.loads(f.readline())
+
+            if os.fstat(f.fileno()).st_size < self._scanned_to:
+                self._offsets, self._scanned_to = {}, 0  # Rewritten shorter, so the index is no good
+            # Scans on from the last stop every time, so lines appended since are picked up
+            f.seek(self._scanned_to)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.strip():
+                    if not line:
+                        return None
+                    self._scanned_to = f.tell()
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if line.endswith(b'\n'):
+                        raise
+                    return None  # A line still being appended; it's read once complete
+                self._scanned_to = f.tell()
+                self._offsets.setdefault(str(record['sku']), offset)
+                if str(record['sku']) == sku:
+                    return record
+
+    def snapshot(self):
+        return {
+            'cached_products': len(self._cache),
+            'hits': self.hits,
+            'loads': self.loads,
+        }
+
+
+def import_jsonl(jsonl_path, db_path):
+    """Load a JSON Lines catalog into a SQLite catalog, replacing products with the same SKU."""
+    db = sqlite3.connect(db_path)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS products ("
+        "sku TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL, "
+        "list_price REAL NOT NULL, min_price REAL NOT NULL)"
+    )
+    count = 0
+    with open(jsonl_path, encoding='utf-8') as f, db:
+        for line in f:
+            if not line.strip():
+                continue
+            product = Product.from_record(json.loads(line))
+            db.execute(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)",
+                (product.sku, product.name, product.description, product.list_price, product.min_price)
+            )
+            count += 1
+    db.close()
+    return count
+
+
+if __name__ == '__main__':
+    # Offline build step for large catalogs: python catalog.py catalog.jsonl catalog.db
+    import sys
+
+    print(f"Imported {import_jsonl(sys.argv[1], sys.argv[2])} products into {sys.argv[2]}")
@@ -0,0 +1,133 @@
+import re
+import threading
+from collections import namedtuple
+
+FastPathResult = namedtuple('FastPathResult', ['intent', 'price', 'confidence'])
+
+# A currency amount such as "£1,250", "1250 GBP", "1.3k", "£1.25k" or "1300.50".
+# Malformed thousands groups such as "1,25" aren't read as an amount at all.
+AMOUNT_RE = re.compile(r"""
+    (?P<prefix>£|\bgbp\s*)?
+    (?<!\d)(?<!\d,)
+    (?P<number>\d{1,3}(?:,\d{3})+|\d+)
+    (?!,?\d)
+    (?:\.(?P<decimals>\d{1,2}))?
+    (?:\s*(?P<suffix>k\b|gbp\b|pounds?\b|quid\b))?
+""", re.IGNORECASE | re.VERBOSE)
+
+# Figures that aren't a price, or can't be read as one reliably: percentages ("10% off", "5 percent")
+# and digit runs split by spaces ("1 300")
+UNREADABLE_FIGURE_RE = re.compile(r"\d\s*(?:%|per\s?cent\b|pc\b)|\d\s+\d", re.IGNORECASE)
+
+# Whole messages that unambiguously accept or reject the current offer
+ACCEPTANCE_PHRASES = frozenset([
+    "deal", "yes", "yes please", "yep", "yeah", "sure", "ok", "okay", "agreed", "accept", "i accept",
+    "sounds good", "that works", "it's a deal", "its a deal", "you've got a deal", "you have a deal",
+    "i'll take it", "ill take it", "go on then", "perfect",
+])
+REJECTION_PHRASES = frozenset([
+    "no", "nope", "nah", "no thanks", "no thank you", "no deal", "not interested", "i'm not interested",
+    "im not interested", "i don't think so", "i dont think so", "pass", "i'll pass", "ill pass",
+    "no way", "forget it",
+])
+# Openers that carry no offer and no decision, so the turn simply carries on
+GREETING_PHRASES = frozenset([
+    "hi", "hello", "hey", "hiya", "good morning", "good afternoon", "good evening",
+])
+
+# Words that signal the message carries an intent beyond a plain counteroffer
+INTENT_WORDS_RE = re.compile(
+    r"\b(deal|yes|yeah|yep|ok|okay|sure|agree[ds]?|accept(?:ed)?|no|not|nah|never|pass|final|take it)\b"
+)
+
+NORMALIZE_RE = re.compile(r"[^\w\s'£.,]")
+MAX_SHORT_MESSAGE_WORDS = 6
+
+
+def normalize(message):
+    """Lower-case a message and strip punctuation that doesn't affect its meaning."""
+    text = NORMALIZE_RE.sub(' ', message.lower().replace('’', "'"))
+    return ' '.join(text.split()).strip(' .,')
+
+
+def extract_amounts(message):
+    """
+    Return (value, has_currency_marker) for every plausible amount in the message.
+    Bare single digits are skipped as they're more likely quantities than prices.
+    """
+    amounts = []
+    for match in AMOUNT_RE.finditer(message):
+        number = match.group('number').replace(',', '')
+        decimals = match.group('decimals')
+        suffix = (match.group('suffix') or '').lower()
+        marked = bool(match.group('prefix') or suffix)
+        if not marked and len(number) < 2:
+            continue
+        value = float(f"{number}.{decimals}" if decimals else number)
+        if suffix == 'k':
+            value *= 1000
+        amounts.append((round(value, 2), marked))
+    return amounts
+
+
+def analyze(message):
+    """
+    Classify a buyer's message and extract its price without calling the LLM.
+
+    Returns a FastPathResult whose confidence is between 0 and 1; callers
+    should only trust results above their own threshold.
+    """
+    text = normalize(message)
+    if UNREADABLE_FIGURE_RE.search(message):
+        return FastPathResult('unknown', None, 0.0)
+    amounts = extract_amounts(message)
+
+    if text in ACCEPTANCE_PHRASES and not amounts:
+        return FastPathResult('acceptance', None, 0.95)
+    if text in REJECTION_PHRASES and not amounts:
+        return FastPathResult('rejection', None, 0.95)
+
+    if text in GREETING_PHRASES:
+        return FastPathResult('unknown', None, 0.9)
+
+    if amounts and not INTENT_WORDS_RE.search(text):
+        values = {value for value, _ in amounts}
+        price = amounts[-1][0]
+        if len(values) > 1:
+            # Several different figures, e.g. quoting the bot's price back
+            return FastPathResult('negotiation', price, 0.4)
+        if any(marked for _, marked in amounts):
+            return FastPathResult('negotiation', price, 0.95)
+        if len(text.split()) <= MAX_SHORT_MESSAGE_WORDS:
+            return FastPathResult('negotiation', price, 0.85)
+        return FastPathResult('negotiation', price, 0.6)
+
+    return FastPathResult('unknown', amounts[-1][0] if amounts else None, 0.0)
+
+
+class FastPathStats:
+    """
+    Thread-safe counters of how often the fast path answered without the LLM.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'llm_calls_saved': self.hits,
+            }
@@ -0,0 +1,148 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+
+# Upper bounds in seconds, suited to LLM calls from tens of milliseconds to a cold model load
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts observations above every bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """
+    Times one LLM call and records its outcome and token counts on exit.
+
+    The outcome is 'ok' unless the call raised ('error') or was cancelled
+    ('cancelled'); callers may set it to something else, such as 'cached',
+    before the span ends.
+    """
+
+    def __init__(self, registry, call_site):
+        self.registry = registry
+        self.call_site = call_site
+        self.outcome = 'ok'
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+
+    def record(self, response_data):
+        """Pick up the token counts Ollama reports in a response."""
+        self.prompt_tokens = response_data.get('prompt_eval_count') or 0
+        self.eval_tokens = response_data.get('eval_count') or 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.outcome = 'cancelled' if issubclass(exc_type, asyncio.CancelledError) else 'error'
+        self.registry.record_span(self, duration)
+        logging.debug(
+            "LLM span %s: %.3fs outcome=%s prompt_tokens=%d eval_tokens=%d",
+            self.call_site, duration, self.outcome, self.prompt_tokens, self.eval_tokens
+        )
+        return False
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, prefix='negotiator'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_counter(self, name, value, **labels):
+        """Set a counter whose running total is kept elsewhere, such as a component's snapshot."""
+        with self._lock:
+            self._counters[self._key(name, labels)] = value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def span(self, call_site):
+        return Span(self, call_site)
+
+    def record_span(self, span, duration):
+        labels = {'call_site': span.call_site}
+        self.observe('llm_call_duration_seconds', duration, outcome=span.outcome, **labels)
+        if span.outcome == 'error':
+            self.inc('llm_errors_total', **labels)
+        if span.prompt_tokens:
+            self.inc('llm_prompt_tokens_total', span.prompt_tokens, **labels)
+        if span.eval_tokens:
+            self.inc('llm_eval_tokens_total', span.eval_tokens, **labels)
+
+    def _format_labels(self, labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = (
+                ('counter', self._counters),
+                ('gauge', self._gauges),
+                ('histogram', self._histograms),
+            )
+            for kind, series in families:
+                for name in sorted({name for name, _ in series}):
+                    full_name = f"{self.prefix}_{name}"
+                    if name in self._help:
+                        lines.append(f"# HELP {full_name} {self._help[name]}")
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    for (series_name, labels), value in sorted(series.items()):
+                        if series_name != name:
+                            continue
+                        if kind != 'histogram':
+                            lines.append(f"{full_name}{self._format_labels(labels)} {value}")
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(list(value.buckets) + ['+Inf'], value.counts):
+                            cumulative += count
+                            lines.append(f"{full_name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+                        lines.append(f"{full_name}_sum{self._format_labels(labels)} {value.sum}")
+                        lines.append(f"{full_name}_count{self._format_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
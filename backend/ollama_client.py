@@ -0,0 +1,252 @@
+import asyncio
+import json
+
+import httpx
+
+import scheduler
+from scheduler import RequestScheduler, PRIORITY_AUX
+from backend_pool import BackendPool, NoBackendAvailable
+
+
+class OllamaClient:
+    """
+    Shared async client for the Ollama chat API, spread over one or more servers.
+
+    Every call goes through one pooled httpx client per event loop, so
+    connections are kept alive and reused across negotiations instead of
+    opening a new TCP connection per request. A RequestScheduler caps how many
+    calls are in flight at once and queues the rest by priority on the event
+    loop, rather than tying up a thread each or piling them up inside Ollama.
+    A BackendPool picks the server for each call and ejects failing ones; a
+    call refused by one server is retried once on another. The scheduler lets
+    `max_concurrency` calls run per server in rotation, so ejecting a server
+    doesn't pile its share onto the others.
+
+    Calls made with hedge=True are sent to a second server if the first hasn't
+    answered within `hedge_delay` seconds and a slot is free, and the first
+    answer wins.
+
+    If `keep_alive` is set, every call asks Ollama to keep the model loaded for
+    that long afterwards (a negative duration keeps it loaded indefinitely).
+    """
+
+    def __init__(self, urls, timeout=120.0, connect_timeout=5.0, max_connections=32,
+                 max_concurrency=4, max_queue=64, keepalive_expiry=60.0, on_wait=None,
+                 failure_threshold=3, reset_timeout=15.0, health_interval=10.0, hedge_delay=None,
+                 keep_alive=None):
+        self.pool = BackendPool([urls] if isinstance(urls, str) else urls, failure_threshold, reset_timeout)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.keepalive_expiry = keepalive_expiry
+        self.on_wait = on_wait
+        self.health_interval = health_interval
+        self.hedge_delay = hedge_delay
+        self.keep_alive = keep_alive
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self._clients = {}  # event loop -> (httpx.AsyncClient, RequestScheduler, health check task)
+
+    def _for_loop(self):
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+            queue = RequestScheduler(self.max_concurrency * len(self.pool.backends), self.max_queue, self.on_wait)
+            health_task = None
+            if self.health_interval:
+                health_task = loop.create_task(self._check_health(client, queue))
+            entry = self._clients[loop] = (client, queue, health_task)
+        return entry
+
+    async def _check_health(self, client, queue):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.pool.check_health(client)
+            self._resize(queue)
+
+    def _resize(self, queue):
+        # At least one slot, so a trial call can still bring an ejected server back
+        queue.resize(self.max_concurrency * max(1, self.pool.in_rotation()))
+
+    def _timeout(self, timeout):
+        """
+        Return the httpx timeout for a call, and whether it was cut short to fit the turn's deadline.
+        A call never outlives the turn it belongs to.
+        """
+        full = self.timeout if timeout is None else timeout
+        left = scheduler.remaining()
+        if left is not None and left < full:
+            return httpx.Timeout(max(left, 0.001), connect=self.connect_timeout), True
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT, False
+        return httpx.Timeout(timeout, connect=self.connect_timeout), False
+
+    async def chat(self, payload, timeout=None, priority=PRIORITY_AUX, hedge=False):
+        """
+        POST `payload` to the chat endpoint and return the decoded JSON response.
+
+        `timeout` overrides the default read timeout for this call only.
+        Raises httpx.HTTPError on connection failures, timeouts and non-2xx responses,
+        scheduler.SchedulerRejected if the call was turned away before being sent,
+        and NoBackendAvailable if every server is ejected.
+        """
+        client, queue, _ = self._for_loop()
+        self._resize(queue)
+        async with queue.slot(priority):
+            if hedge and self.hedge_delay is not None and len(self.pool.backends) > 1:
+                return await self._hedged_post(client, queue, payload, timeout)
+            backend = self.pool.pick()
+            try:
+                return await self._post(client, backend, payload, timeout)
+            except httpx.HTTPError as e:
+                fallback = self._failover(backend, e)
+            return await self._post(client, fallback, payload, timeout)
+
+    def _failover(self, backend, error):
+        """
+        Pick another server to retry a call that `backend` failed with `error`, or re-raise it.
+        Timeouts aren't retried, as the time they took is already gone.
+        """
+        if isinstance(error, httpx.TimeoutException):
+            raise error
+        try:
+            return self.pool.pick(exclude=(backend,))
+        except NoBackendAvailable:
+            raise error from None
+
+    def _body(self, payload, **overrides):
+        if self.keep_alive is not None:
+            overrides.setdefault('keep_alive', self.keep_alive)
+        return {**payload, **overrides}
+
+    async def _post(self, client, backend, payload, timeout):
+        request_timeout, cut_short = self._timeout(timeout)
+        with self.pool.track(backend, cut_short):
+            response = await client.post(backend.url, json=self._body(payload), timeout=request_timeout)
+            response.raise_for_status()
+            return response.json()
+
+    async def _hedged_post(self, client, queue, payload, timeout):
+        primary = self.pool.pick()
+        first = asyncio.create_task(self._post(client, primary, payload, timeout))
+        tasks = {first}
+        hedged = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if done:
+                try:
+                    return first.result()
+                except httpx.HTTPError as e:
+                    fallback = self._failover(primary, e)
+                return await self._post(client, fallback, payload, timeout)
+
+            if queue.try_acquire():
+                hedged = True
+                try:
+                    backup = self.pool.pick(exclude=(primary,))
+                except NoBackendAvailable:
+                    pass
+                else:
+                    self.hedges_sent += 1
+                    tasks.add(asyncio.create_task(self._post(client, backup, payload, timeout)))
+
+            # Return the first successful answer, or the first error if none succeeds
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedges_won += 1
+                        return task.result()
+            return first.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # Mark a losing error as retrieved
+            if hedged:
+                queue.release()
+
+    async def chat_stream(self, payload, timeout=None, priority=PRIORITY_AUX):
+        """
+        Stream a chat response, yielding each decoded chunk as Ollama produces it.
+
+        The final chunk has "done" set and carries the token counts and timings.
+        """
+        client, queue, _ = self._for_loop()
+        self._resize(queue)
+        async with queue.slot(priority):
+            backend = self.pool.pick()
+            started = False
+            for retry in (False, True):
+                try:
+                    request_timeout, cut_short = self._timeout(timeout)
+                    with self.pool.track(backend, cut_short):
+                        async with client.stream('POST', backend.url, json=self._body(payload, stream=True), timeout=request_timeout) as response:
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if line.strip():
+                                    started = True
+                                    yield json.loads(line)
+                    return
+                except httpx.HTTPError as e:
+                    if started or retry:
+                        raise  # Part of the reply is already out, so it can't be retried elsewhere
+                    backend = self._failover(backend, e)
+
+    async def broadcast(self, payload, backends=None, timeout=None):
+        """
+        POST `payload` to each of `backends`, or every server, at once, bypassing the scheduler.
+        Returns {url: None on success, or the exception raised}.
+        """
+        client, _, _ = self._for_loop()
+        backends = self.pool.backends if backends is None else backends
+        results = await asyncio.gather(
+            *(self._post(client, backend, payload, timeout) for backend in backends),
+            return_exceptions=True
+        )
+        return {
+            backend.url: result if isinstance(result, Exception) else None
+            for backend, result in zip(backends, results)
+        }
+
+    def overloaded(self):
+        """Whether the queue of calls waiting for a slot is full."""
+        return self._for_loop()[1].overloaded()
+
+    def scheduler_snapshot(self):
+        """Scheduler counters summed over every event loop."""
+        totals = {}
+        for _, queue, _ in list(self._clients.values()):
+            for name, value in queue.snapshot().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def backends_snapshot(self):
+        """Per-server routing and circuit breaker state, plus hedging counters."""
+        return {
+            'backends': self.pool.snapshot(),
+            'hedges_sent': self.hedges_sent,
+            'hedges_won': self.hedges_won,
+        }
+
+    async def aclose(self):
+        """Close the pooled connections belonging to the running event loop."""
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            client, _, health_task = entry
+            if health_task is not None:
+                health_task.cancel()
+            await client.aclose()
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import string
+import tempfile
+import time
+
+# Fixed bot messages, with placeholders filled in when a rendering is served; {price} includes the currency
+TEMPLATES = {
+    'deal_closed': (
+        "Deal closed! We've accepted your offer of {price}. "
+        "Here's your discount code: {discount_code}. Thank you for negotiating with us!"
+    ),
+    'rejection': "Sorry that we couldn't reach an agreement. Better luck next time!",
+    'max_attempts': "We've reached the maximum negotiation attempts. Our final price is {price}.",
+}
+
+
+def placeholders(text):
+    """Return the set of format placeholders in `text`, raising ValueError if it isn't a valid format string."""
+    return {field for _, field, _, _ in string.Formatter().parse(text) if field is not None}
+
+
+class PhrasingPool:
+    """
+    Pre-generated, varied renderings of the fixed bot messages.
+
+    Renderings keep the template's placeholders, so serving one is a local
+    random choice plus str.format rather than an LLM round trip. The pool is
+    saved to `path` and counts as stale once it is older than `max_age`, was
+    generated by a different model or for different template text; stale
+    pools keep serving while a replacement is generated in the background.
+    Templates with no usable renderings are served verbatim.
+    """
+
+    RETRY_INTERVAL = 300  # Seconds between background refresh attempts after a failure
+
+    def __init__(self, path, model, templates=TEMPLATES, variants=8, max_age=7 * 24 * 3600):
+        self.path = path
+        self.model = model
+        self.templates = templates
+        self.variants = variants
+        self.max_age = max_age
+        self.renderings = {name: [] for name in templates}
+        self.generated_at = 0
+        self._source = {}  # template text the stored renderings were generated from
+        self._stored_model = None
+        self._refresh_task = None
+        self._last_attempt = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.generated_at = data['generated_at']
+            self._stored_model = data['model']
+            for name, entry in data['templates'].items():
+                if name in self.templates and entry['template'] == self.templates[name]:
+                    self.renderings[name] = [text for text in entry['renderings'] if self.is_valid(name, text)]
+                    self._source[name] = entry['template']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"Could not load phrasing pool from {self.path}: {e}")
+
+    def save(self):
+        data = {
+            'model': self.model,
+            'generated_at': self.generated_at,
+            'templates': {
+                name: {'template': template, 'renderings': self.renderings[name]}
+                for name, template in self.templates.items()
+            }
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # A name of its own, so workers refreshing at the same time don't write into one file
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False,
+                                         prefix=f"{os.path.basename(self.path)}.", suffix='.tmp') as f:
+            tmp_path = f.name
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def is_valid(self, name, text):
+        """Check a rendering keeps exactly the template's placeholders and nothing else."""
+        if not text or len(text) > 3 * len(self.templates[name]):
+            return False
+        try:
+            return placeholders(text) == placeholders(self.templates[name])
+        except ValueError:
+            return False
+
+    def is_stale(self):
+        return (
+            self._stored_model != self.model
+            or time.time() - self.generated_at > self.max_age
+            or any(self._source.get(name) != template for name, template in self.templates.items())
+        )
+
+    def render(self, name, **values):
+        """Return a random rendering of template `name` with `values` filled in."""
+        options = self.renderings.get(name) or [self.templates[name]]
+        return random.choice(options).format(**values)
+
+    async def refresh(self, generate):
+        """
+        Regenerate every template's renderings with `generate(template)` and save the pool.
+        `generate` is a coroutine function returning one candidate rewording.
+        """
+        renderings = {}
+        for name, template in self.templates.items():
+            candidates = await asyncio.gather(
+                *(generate(template) for _ in range(self.variants)),
+                return_exceptions=True
+            )
+            valid = [text for text in candidates if isinstance(text, str) and self.is_valid(name, text)]
+            renderings[name] = list(dict.fromkeys(valid))  # Drop duplicates, keep order
+            logging.info(f"Generated {len(renderings[name])}/{self.variants} renderings for '{name}'")
+            if not renderings[name] and self._source.get(name) == template:
+                renderings[name] = self.renderings[name]  # Keep the previous renderings rather than none
+
+        if not any(renderings.values()):
+            raise RuntimeError("no usable renderings were generated")
+        self.renderings = renderings
+        self.generated_at = time.time()
+        self._stored_model = self.model
+        self._source = dict(self.templates)
+        await asyncio.to_thread(self.save)
+
+    def refresh_in_background(self, generate):
+        """Start a refresh on the running event loop if the pool is stale and none is in progress."""
+        if not self.is_stale() or (self._refresh_task is not None and not self._refresh_task.done()):
+            return
+        if time.time() - self._last_attempt < self.RETRY_INTERVAL:
+            return
+        self._last_attempt = time.time()
+        self._refresh_task = asyncio.get_running_loop().create_task(self.refresh(generate))
+        self._refresh_task.add_done_callback(self._log_refresh_failure)
+
+    @staticmethod
+    def _log_refresh_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Phrasing pool refresh failed: {task.exception()}")
+
+
+if __name__ == '__main__':
+    # Offline build step: python phrasing.py
+    import app
+
+    asyncio.run(app.phrasing_pool.refresh(app.generate_phrasing_variant))
+    print(f"Wrote {app.phrasing_pool.path}")
@@ -0,0 +1,57 @@
+def _operations(*values):
+    """
+    `max` and `round` for plain numbers, or their element-wise NumPy versions if any of `values` is an array.
+    NumPy is only imported when the simulator passes it arrays; the service never does.
+    """
+    if any(hasattr(value, '__array__') for value in values):
+        import numpy
+        return numpy.maximum, numpy.round
+    return max, round
+
+
+class ConcessionPolicy:
+    """
+    Decides the seller's offers, so the LLM only has to phrase them.
+
+    Counteroffers follow a concession curve from the opening price down to
+    `floor`, which is reached on the last attempt:
+
+        offer(t) = floor + (opening - floor) * (1 - (t / (max_attempts - 1)) ** shape)
+
+    A shape above 1 holds the price early and concedes late; below 1 it
+    concedes early. A counteroffer is never below the floor or the buyer's best
+    offer so far, and a buyer's offer of at least the floor is accepted once
+    it is within `accept_within` of the counteroffer the seller would
+    otherwise make.
+    """
+
+    def __init__(self, floor, max_attempts, shape=1.0, accept_within=0.02):
+        self.floor = floor
+        self.max_attempts = max_attempts
+        self.shape = shape
+        self.accept_within = accept_within
+
+    def curve(self, opening, attempt):
+        """
+        Offer on the concession curve after `attempt` counteroffers, unrounded.
+        Works element-wise on NumPy arrays as well as on numbers.
+        """
+        progress = attempt / max(1, self.max_attempts - 1)
+        return self.floor + (opening - self.floor) * (1 - progress ** self.shape)
+
+    def counter(self, opening, attempt, best_buyer_offer=None):
+        """
+        The counteroffer to make after `attempt` counteroffers, in whole currency units.
+        `opening` and `best_buyer_offer` may be NumPy arrays of sessions all at the same attempt.
+        """
+        maximum, round_ = _operations(opening, best_buyer_offer)
+        offer = self.curve(opening, min(attempt, self.max_attempts - 1))
+        if best_buyer_offer is not None:
+            offer = maximum(offer, best_buyer_offer)
+        return maximum(round_(offer), self.floor)
+
+    def accepts(self, buyer_offer, counter):
+        """Whether to take `buyer_offer` rather than counter with `counter`. Works element-wise on NumPy arrays."""
+        if buyer_offer is None:
+            return False
+        return (buyer_offer >= self.floor) & (buyer_offer >= counter * (1 - self.accept_within))
@@ -0,0 +1,22 @@
+CHARS_PER_TOKEN = 4  # Rough average for English text with llama tokenizers, unverified against a real one; loadgen reports the ratio the mock sees
+
+
+def estimate_tokens(text):
+    """Cheap token count estimate, good enough for budgeting prompts."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def window_history(history, budget):
+    """
+    Return the most recent messages of `history` that fit in `budget` estimated tokens.
+    The latest message is always kept, however long it is.
+    """
+    used = 0
+    start = len(history)
+    while start > 0:
+        cost = estimate_tokens(history[start - 1]['content'])
+        if used + cost > budget and start < len(history):
+            break
+        used += cost
+        start -= 1
+    return history[start:]
@@ -0,0 +1,250 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of Ollama responses.
+
+    Entries are keyed by a hash of the full request payload, so a change to
+    the model, a system prompt or the message produces a different key and
+    stale answers are never served. Lookups go to an in-memory LRU tier
+    first, then to an optional SQLite file that survives restarts. Rows
+    written for a different `namespace` (the model name) are purged when the
+    file is opened.
+
+    Only the memory tier is touched inline: `fetch` reads the file on a
+    worker thread and `set` queues the row for a write-behind thread, so a
+    cached call on the event loop never waits on disk.
+    """
+
+    TRIM_EVERY = 500  # Writes between expiry/size sweeps of the SQLite tier
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600, db_path=None, max_disk_entries=100000, namespace='',
+                 flush_interval=0.05):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.namespace = namespace
+        self.flush_interval = flush_interval
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.db_path = db_path or None
+        self._pid = None  # Process the writer belongs to
+        self._open_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._readers = threading.local()  # One read connection per thread
+        self._pending = {}  # key -> (serialized value, expires_at) waiting to be written
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.flush_errors = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA busy_timeout=5000")  # Other workers write to the same file
+        return db
+
+    def _ensure_open(self):
+        """Open the file and start the writer in this process, if not done yet."""
+        if self._pid == os.getpid():
+            return
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            # Anything inherited from a parent process belongs to it, locks included
+            self._pending = {}
+            self._pending_lock = threading.Lock()
+            self._writer_lock = threading.Lock()
+            self._wake = threading.Event()
+            self._writer = self._connect()
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            self._writer.execute("PRAGMA synchronous=NORMAL")
+            self._writer.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._writer.execute(
+                "DELETE FROM responses WHERE namespace != ? OR expires_at <= ?", (self.namespace, time.time())
+            )
+            threading.Thread(target=self._write_behind, name='response-cache-write-behind', daemon=True).start()
+            if self._pid is None:
+                atexit.register(self.close)
+            self._pid = os.getpid()
+
+    def _reader(self):
+        self._ensure_open()
+        readers = self._readers
+        if getattr(readers, 'pid', None) != os.getpid():
+            readers.db = self._connect()
+            readers.pid = os.getpid()
+        return readers.db
+
+    @staticmethod
+    def key(payload):
+        """Return the content address of a request payload."""
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _from_memory(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            del self._memory[key]
+            return None
+
+    def _from_disk(self, key, now):
+        """Look `key` up in the SQLite tier, promoting a hit to memory. Blocking."""
+        row = None
+        if self.db_path is not None:
+            with self._pending_lock:
+                row = self._pending.get(key)  # Evicted from memory before its write landed
+            if row is None:
+                try:
+                    row = self._reader().execute(
+                        "SELECT value, expires_at FROM responses WHERE key = ? AND namespace = ?",
+                        (key, self.namespace)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logging.error(f"Error reading the response cache: {e}")
+        with self._lock:
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            self.disk_hits += 1
+            return value
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss. May block on disk; use `fetch` on the loop."""
+        now = time.time()
+        value = self._from_memory(key, now)
+        if value is None:
+            value = self._from_disk(key, now)
+        return value
+
+    async def fetch(self, key):
+        """`get` for the event loop: memory inline, the SQLite tier on a worker thread."""
+        now = time.time()
+        value = self._from_memory(key, now)
+        if value is None:
+            if self.db_path is None:
+                return self._from_disk(key, now)
+            value = await asyncio.to_thread(self._from_disk, key, now)
+        return value
+
+    def set(self, key, value):
+        """Cache a JSON-serializable value under `key`. The disk write happens in the background."""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+        if self.db_path is None:
+            return
+        self._ensure_open()
+        with self._pending_lock:
+            self._pending[key] = (json.dumps(value), expires_at)
+        self._wake.set()
+
+    def _write_behind(self):
+        wake = self._wake
+        while not self._closed:
+            if wake.wait(self.flush_interval):
+                wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every queued entry to disk in one transaction."""
+        if self._writer is None:
+            return
+        with self._writer_lock:
+            with self._pending_lock:
+                batch = self._pending
+                self._pending = {}
+            if not batch:
+                return
+            try:
+                self._writer.execute("BEGIN IMMEDIATE")
+                try:
+                    self._writer.executemany(
+                        "INSERT OR REPLACE INTO responses (key, namespace, value, expires_at) VALUES (?, ?, ?, ?)",
+                        [(key, self.namespace, value, expires_at) for key, (value, expires_at) in batch.items()]
+                    )
+                    self._writer.execute("COMMIT")
+                except BaseException:
+                    self._writer.execute("ROLLBACK")
+                    raise
+                self._writes += len(batch)
+                if self._writes >= self.TRIM_EVERY:
+                    self._writes = 0
+                    self._trim_disk()
+            except sqlite3.Error as e:
+                # Losing cache rows only costs a future LLM call, so they aren't retried
+                logging.error(f"Error writing {len(batch)} cached responses: {e}")
+                self.flush_errors += 1
+
+    def _trim_disk(self):
+        self._writer.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        excess = self._writer.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            self._writer.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires_at LIMIT ?)",
+                (excess,)
+            )
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        if self.db_path is None:
+            return
+        self._ensure_open()
+        with self._writer_lock:
+            with self._pending_lock:
+                self._pending = {}
+            self._writer.execute("DELETE FROM responses")
+
+    def close(self):
+        """Stop the write-behind thread after writing out anything still queued."""
+        if self._pid != os.getpid() or self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / total if total else 0.0,
+                'memory_entries': len(self._memory),
+            }
@@ -0,0 +1,173 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+
+# Lower numbers are served first
+PRIORITY_CHAT = 0  # The negotiation reply a buyer is waiting on
+PRIORITY_AUX = 1  # Classification and price extraction
+PRIORITY_BACKGROUND = 2  # Phrasing pool refreshes and other work nobody is waiting on
+PRIORITY_NAMES = {PRIORITY_CHAT: 'chat', PRIORITY_AUX: 'aux', PRIORITY_BACKGROUND: 'background'}
+
+# Monotonic time by which the current turn's LLM calls must have started, inherited by its tasks
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class SchedulerRejected(Exception):
+    """A request was turned away without reaching Ollama."""
+
+
+class QueueFull(SchedulerRejected):
+    pass
+
+
+class DeadlineExceeded(SchedulerRejected):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Give every LLM call made in this context, including from tasks it creates,
+    `seconds` to get a slot. An enclosing, earlier deadline still applies.
+    """
+    current = _deadline.get()
+    new = time.monotonic() + seconds
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline, or None if there is none."""
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+class RequestScheduler:
+    """
+    Admits outbound LLM requests in priority order, at most `max_concurrency` at once.
+
+    Requests beyond that wait in a queue ordered by priority, then arrival.
+    When `max_queue` requests are already waiting, a new request displaces the
+    lowest-priority waiter if it outranks it, and is rejected with QueueFull
+    otherwise. A request still waiting when the current deadline passes is
+    rejected with DeadlineExceeded. `on_wait(priority_name, seconds)` is called
+    with the queueing time of every admitted request.
+
+    Bound to the event loop it is first used on.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=64, on_wait=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.on_wait = on_wait
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        self._waiters = []  # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def overloaded(self):
+        """Whether a new turn would only end up rejected or waiting behind a full queue."""
+        return len(self._waiters) >= self.max_queue
+
+    def try_acquire(self):
+        """Take a slot only if one is free with nobody waiting, for optional work such as hedged requests."""
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=PRIORITY_AUX):
+        """Hold one of the concurrency slots for the duration of the block."""
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def _acquire(self, priority):
+        started = time.monotonic()
+        left = remaining()
+        if left is not None and left <= 0:
+            self.rejected_deadline += 1
+            raise DeadlineExceeded("Turn deadline passed before the request was queued")
+
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._shed(priority)
+            future = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self._sequence), future)
+            heapq.heappush(self._waiters, entry)
+            try:
+                await asyncio.wait_for(future, left)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    self.release()  # A slot was handed over just as we gave up on it
+                elif entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.rejected_deadline += 1
+                    raise DeadlineExceeded("Turn deadline passed while waiting for a slot") from None
+                raise
+
+        self.admitted += 1
+        if self.on_wait is not None:
+            self.on_wait(PRIORITY_NAMES.get(priority, str(priority)), time.monotonic() - started)
+
+    def _shed(self, priority):
+        """Make room in a full queue by rejecting its lowest-priority waiter, if `priority` outranks it."""
+        lowest = max(self._waiters)
+        self.rejected_queue_full += 1
+        if lowest[0] <= priority:
+            raise QueueFull(f"{len(self._waiters)} requests already waiting")
+        self._waiters.remove(lowest)
+        heapq.heapify(self._waiters)
+        lowest[2].set_exception(QueueFull("Displaced by a higher-priority request"))
+
+    def release(self):
+        """Give back a slot, handing it straight to the next waiter if there is one."""
+        if self.in_flight <= self.max_concurrency:  # Over a lowered limit, the slot just goes away
+            while self._waiters:
+                future = heapq.heappop(self._waiters)[2]
+                if not future.done():
+                    future.set_result(None)  # Hand the slot straight over, in_flight is unchanged
+                    return
+        self.in_flight -= 1
+
+    def resize(self, max_concurrency):
+        """
+        Change how many requests may be in flight. Waiters are admitted at once if the limit
+        grew; if it shrank, requests already in flight finish and their slots aren't reused.
+        """
+        self.max_concurrency = max_concurrency
+        while self._waiters and self.in_flight < self.max_concurrency:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def snapshot(self):
+        return {
+            'in_flight': self.in_flight,
+            'queue_depth': len(self._waiters),
+            'admitted': self.admitted,
+            'rejected_queue_full': self.rejected_queue_full,
+            'rejected_deadline': self.rejected_deadline,
+        }
@@ -0,0 +1,488 @@
+import asyncio
+import atexit
+import concurrent.futures
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+STALE_VERSION = -1  # Version of a copy whose write lost to another process's, never found on disk
+
+
+class NegotiationSession:
+    """
+    Negotiation state for a single buyer.
+    """
+    __slots__ = ('session_id', 'product', 'history', 'offers', 'attempts', 'closed', 'last_price', 'opening_price',
+                 'last_access', 'version')
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.product = None  # catalog.Product being negotiated, set by /initialize
+        self.history = []  # user/assistant turns only, the prompts are rebuilt around them
+        self.offers = []  # (role, price) for every price either side has named
+        self.attempts = 0
+        self.closed = False
+        self.last_price = None
+        self.opening_price = None
+        self.last_access = time.monotonic()
+        self.version = 0  # Version on disk once this process's saves are written, 0 if never saved
+
+    def state(self):
+        return json.dumps({
+            'history': self.history,
+            'offers': self.offers,
+            'attempts': self.attempts,
+            'closed': self.closed,
+            'last_price': self.last_price,
+            'opening_price': self.opening_price,
+        })
+
+    @classmethod
+    def from_state(cls, session_id, product, state, version):
+        session = cls(session_id)
+        state = json.loads(state)
+        session.product = product
+        session.history = state['history']
+        session.offers = [tuple(offer) for offer in state['offers']]
+        session.attempts = state['attempts']
+        session.closed = state['closed']
+        session.last_price = state['last_price']
+        session.opening_price = state['opening_price']
+        session.version = version
+        return session
+
+
+class PendingSave:
+    """
+    A session's saves queued since its last write: the newest state, to be written only if the
+    version on disk is still `base_version`, and a future per save resolved once it is written.
+    """
+    __slots__ = ('sku', 'state', 'base_version', 'version', 'futures')
+
+    def __init__(self, sku, state, base_version, version):
+        self.sku = sku
+        self.state = state
+        self.base_version = base_version
+        self.version = version
+        self.futures = []
+
+
+class SessionStore:
+    """
+    Thread-safe store of negotiation sessions keyed by session id.
+
+    Sessions are spread over a number of stripes, each with its own lock, so
+    concurrent requests for different buyers rarely contend. Each stripe keeps
+    its sessions in least-recently-used order; sessions idle for longer than
+    `ttl` seconds are dropped, and the least recently used ones are evicted
+    once a stripe is full.
+
+    With a `db_path`, sessions are also kept in a SQLite file in WAL mode that
+    every worker process shares, so a buyer's next turn can land on any worker
+    and open negotiations survive a restart. `save` only queues the session's
+    state; a background thread writes everything queued in one transaction as
+    soon as it is free, and with synchronous=NORMAL a commit doesn't wait on
+    an fsync. Each write is a compare-and-set against the version the session
+    was loaded at, so when two workers change the same session only the first
+    write lands; the other is counted as a conflict and its copy dropped, to be
+    reloaded on the next `get`. A `db_path` that can't be written is ignored
+    with a warning, leaving sessions in memory only.
+
+    `get` serves sessions from the stripes, checking with a single-row read
+    that no other process has moved them on; it never blocks on writes, and
+    `fetch` runs it off the event loop. Rows idle for longer than `ttl` are
+    compacted every `compact_interval` seconds. `resolve_product(sku)` turns
+    the stored SKU back into the session's product. The file is opened, and
+    the writer started, on first use in each process, so workers forked from
+    a parent that already used the store get their own.
+    """
+
+    def __init__(self, ttl=1800, max_sessions=10000, stripes=16, db_path=None, resolve_product=None,
+                 flush_interval=0.05, compact_interval=300):
+        self.ttl = ttl
+        self._stripes = [OrderedDict() for _ in range(stripes)]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._stripe_capacity = max(1, max_sessions // stripes)
+        if db_path is not None and not self._writable(db_path):
+            logging.warning(
+                f"Can't write session file {db_path}, keeping sessions in memory only: "
+                f"each worker process has its own and they're lost on restart"
+            )
+            db_path = None
+        self.db_path = db_path
+        self.resolve_product = resolve_product
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self._pid = None  # Process the writer belongs to
+        self._open_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._readers = threading.local()  # One read connection per thread, so reads never queue on a lock
+        self._pending = {}  # session id -> PendingSave, or None to delete it
+        self._writing = {}  # The batch being written, taken out of _pending
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self.disk_loads = 0
+        self.stale_reloads = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.conflicts = 0
+        self.flush_errors = 0
+        self.compacted = 0
+
+    @staticmethod
+    def _writable(db_path):
+        """Whether the file can be created or written, checked without opening it, so a fork can follow."""
+        directory = os.path.dirname(os.path.abspath(db_path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            return False
+        if os.path.exists(db_path):
+            return os.access(db_path, os.R_OK | os.W_OK) and os.access(directory, os.W_OK)
+        return os.access(directory, os.W_OK)
+
+    @property
+    def persistent(self):
+        return self.db_path is not None
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA busy_timeout=5000")  # Other workers write to the same file
+        return db
+
+    def _ensure_open(self):
+        """Open the file and start the writer in this process, if not done yet."""
+        if self._pid == os.getpid():
+            return
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            # Anything inherited from a parent process belongs to it, locks included
+            self._pending, self._writing = {}, {}
+            self._pending_lock = threading.Lock()
+            self._writer_lock = threading.Lock()
+            self._wake = threading.Event()
+            self._writer = self._connect()
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            self._writer.execute("PRAGMA synchronous=NORMAL")  # No fsync per commit, only at checkpoints
+            self._writer.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, sku TEXT, state TEXT NOT NULL, "
+                "version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._writer.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            threading.Thread(target=self._write_behind, name='session-write-behind', daemon=True).start()
+            if self._pid is None:
+                atexit.register(self.close)
+            self._pid = os.getpid()
+
+    def _reader(self):
+        readers = self._readers
+        if getattr(readers, 'pid', None) != os.getpid():
+            readers.db = self._connect()
+            readers.pid = os.getpid()
+        return readers.db
+
+    def _index(self, session_id):
+        return hash(session_id) % len(self._stripes)
+
+    def _evict_expired(self, stripe, now):
+        # Stripes are in access order, so expired sessions are always at the front
+        while stripe:
+            oldest = next(iter(stripe.values()))
+            if now - oldest.last_access <= self.ttl:
+                break
+            stripe.popitem(last=False)
+
+    def _insert(self, stripe, session):
+        self._evict_expired(stripe, session.last_access)
+        stripe[session.session_id] = session
+        while len(stripe) > self._stripe_capacity:
+            stripe.popitem(last=False)  # Still on disk, if there is one
+
+    def create(self):
+        """Create and register a new session with a fresh random id."""
+        session = NegotiationSession(secrets.token_urlsafe(16))
+        index = self._index(session.session_id)
+        with self._locks[index]:
+            self._insert(self._stripes[index], session)
+        return session
+
+    def get(self, session_id):
+        """Return the live session for `session_id`, or None if unknown or expired."""
+        if not session_id:
+            return None
+        index = self._index(session_id)
+        now = time.monotonic()
+        with self._locks[index]:
+            stripe = self._stripes[index]
+            session = stripe.get(session_id)
+            if session is not None and now - session.last_access > self.ttl:
+                del stripe[session_id]
+                session = None
+            if not self.persistent:
+                if session is None:
+                    return None
+                session.last_access = now
+                stripe.move_to_end(session_id)
+                return session
+
+        # Outside the stripe lock, so other buyers in the stripe don't wait on the read
+        newest = self._refresh(session_id, session)
+        with self._locks[index]:
+            stripe = self._stripes[index]
+            if newest is None:
+                stripe.pop(session_id, None)
+                return None
+            if stripe.get(session_id) is not newest:
+                self._insert(stripe, newest)
+            newest.last_access = now
+            stripe.move_to_end(session_id)
+            return newest
+
+    async def fetch(self, session_id):
+        """`get` for async code: with a file to read, it runs on a worker thread rather than the event loop."""
+        if not self.persistent:
+            return self.get(session_id)
+        return await asyncio.to_thread(self.get, session_id)
+
+    def _refresh(self, session_id, session):
+        """
+        Return the newest copy of a session: `session` unless another process has saved it since,
+        otherwise the one on disk, or None if it is gone.
+        """
+        self._ensure_open()
+        with self._pending_lock:
+            queued = session_id in self._pending or session_id in self._writing
+            pending = self._pending.get(session_id, self._writing.get(session_id))
+        if queued:
+            # Saved here and not written yet, so this process's copy is the newest
+            if pending is None:
+                return None
+            if session is not None:
+                return session
+            return self._from_state(session_id, pending.sku, pending.state, pending.version)
+
+        db = self._reader()
+        if session is not None:
+            on_disk = db.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if on_disk is None and session.version == 0:
+                return session  # Created here and never saved
+            if on_disk is not None and on_disk[0] == session.version:
+                return session
+        row = db.execute(
+            "SELECT sku, state, version FROM sessions WHERE session_id = ? AND updated_at > ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None  # Discarded or compacted away
+        if session is None:
+            self.disk_loads += 1
+        else:
+            self.stale_reloads += 1
+        return self._from_state(session_id, *row)
+
+    def _from_state(self, session_id, sku, state, version):
+        product = None
+        if sku is not None and self.resolve_product is not None:
+            product = self.resolve_product(sku)
+            if product is None:
+                return None  # Dropped from the catalog since
+        return NegotiationSession.from_state(session_id, product, state, version)
+
+    def save(self, session):
+        """
+        Queue the session's current state to be written to disk.
+        Returns a concurrent.futures.Future resolved with whether the write landed,
+        or None without a file.
+        """
+        if not self.persistent:
+            return None
+        self._ensure_open()
+        future = concurrent.futures.Future()
+        sku = session.product.sku if session.product is not None else None
+        state = session.state()
+        with self._pending_lock:
+            pending = self._pending.get(session.session_id)
+            if pending is None:
+                pending = self._pending[session.session_id] = PendingSave(sku, state, session.version, session.version + 1)
+            else:
+                # Still unwritten, so the write is checked against the version the first save started from
+                pending.sku, pending.state, pending.version = sku, state, session.version + 1
+            pending.futures.append(future)
+            session.version += 1
+        self._wake.set()
+        return future
+
+    def discard(self, session_id):
+        """Forget a session, if present."""
+        if not session_id:
+            return
+        index = self._index(session_id)
+        with self._locks[index]:
+            session = self._stripes[index].pop(session_id, None)
+            if session is not None:
+                # Its version number is now the winner's too, so make sure it never passes for the copy on disk
+                session.version = STALE_VERSION
+        if self.persistent:
+            self._ensure_open()
+            with self._pending_lock:
+                pending = self._pending.get(session_id)
+                self._pending[session_id] = None
+            if pending is not None:
+                for future in pending.futures:
+                    future.set_result(False)
+            self._wake.set()
+
+    def sweep(self):
+        """Drop every expired session."""
+        now = time.monotonic()
+        for lock, stripe in zip(self._locks, self._stripes):
+            with lock:
+                self._evict_expired(stripe, now)
+
+    def _write_behind(self):
+        wake = self._wake
+        last_compaction = time.monotonic()
+        while not self._closed:
+            # Saves made while a batch is being written wait for the next one
+            if wake.wait(self.flush_interval):
+                wake.clear()
+            self.flush()
+            if time.monotonic() - last_compaction >= self.compact_interval:
+                last_compaction = time.monotonic()
+                self.compact()
+
+    def flush(self):
+        """Write every queued save and discard to disk in one transaction."""
+        if self._writer is None:
+            return
+        with self._writer_lock:
+            with self._pending_lock:
+                batch = self._writing = self._pending
+                self._pending = {}
+            if not batch:
+                return
+            try:
+                conflicts = self._write(batch)
+            except sqlite3.Error as e:
+                logging.error(f"Error writing {len(batch)} sessions, retrying: {e}")
+                self.flush_errors += 1
+                with self._pending_lock:
+                    for session_id, pending in batch.items():
+                        self._requeue(session_id, pending)
+                    self._writing = {}
+                return
+            # Before the batch stops counting as queued, so no `get` in between trusts a losing copy
+            for session_id in conflicts:
+                self._drop_conflicted(session_id)
+            with self._pending_lock:
+                self._writing = {}
+        self.flushes += 1
+        self.rows_written += len(batch) - len(conflicts)
+        for session_id, pending in batch.items():
+            if pending is not None:
+                for future in pending.futures:
+                    future.set_result(session_id not in conflicts)
+
+    def _write(self, batch):
+        """Apply a batch in one transaction, returning the ids of sessions another process had moved on."""
+        conflicts = set()
+        now = time.time()
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            for session_id, pending in batch.items():
+                if pending is None:
+                    self._writer.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                elif pending.base_version == 0:
+                    written = self._writer.execute(
+                        "INSERT INTO sessions (session_id, sku, state, version, updated_at) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (session_id) DO NOTHING",
+                        (session_id, pending.sku, pending.state, pending.version, now)
+                    ).rowcount
+                    if not written:
+                        conflicts.add(session_id)
+                else:
+                    written = self._writer.execute(
+                        "UPDATE sessions SET sku = ?, state = ?, version = ?, updated_at = ? "
+                        "WHERE session_id = ? AND version = ?",
+                        (pending.sku, pending.state, pending.version, now, session_id, pending.base_version)
+                    ).rowcount
+                    if not written:
+                        conflicts.add(session_id)
+            self._writer.execute("COMMIT")
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        return conflicts
+
+    def _requeue(self, session_id, pending):
+        """Put back a save that failed to be written, merging it with any made since."""
+        if session_id not in self._pending:
+            self._pending[session_id] = pending
+            return
+        newer = self._pending[session_id]
+        if newer is None or pending is None:
+            return  # Discarded since, or the delete is retried as it is
+        newer.base_version = pending.base_version
+        newer.futures = pending.futures + newer.futures
+
+    def _drop_conflicted(self, session_id):
+        """Forget this process's copy of a session whose write lost, so the next `get` reloads it."""
+        self.conflicts += 1
+        logging.warning(f"Session {session_id} was changed by another process, dropping this process's copy")
+        index = self._index(session_id)
+        with self._locks[index]:
+            session = self._stripes[index].pop(session_id, None)
+            if session is not None:
+                # Its version number is now the winner's too, so make sure it never passes for the copy on disk
+                session.version = STALE_VERSION
+
+    def compact(self):
+        """Delete sessions idle for longer than the TTL from disk and fold the WAL back into the database."""
+        try:
+            with self._writer_lock:
+                deleted = self._writer.execute(
+                    "DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.ttl,)
+                ).rowcount
+                self._writer.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error as e:
+            logging.error(f"Error compacting sessions: {e}")
+            return
+        self.compacted += deleted
+        if deleted:
+            logging.info(f"Compacted {deleted} expired sessions")
+
+    def close(self):
+        """Stop the write-behind thread after writing out anything still queued."""
+        if self._pid != os.getpid() or self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def snapshot(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            'cached': len(self),
+            'pending_writes': pending,
+            'disk_loads': self.disk_loads,
+            'stale_reloads': self.stale_reloads,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'conflicts': self.conflicts,
+            'flush_errors': self.flush_errors,
+            'compacted': self.compacted,
+        }
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self._stripes)
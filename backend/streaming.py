@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+
+class TokenRelay:
+    """
+    Carries reply tokens from a streaming Ollama call to an SSE response.
+
+    Tokens are buffered until release() is called, because a reply requested
+    speculatively may still be cancelled before the user should see it. If
+    the relay is closed without being released, iterating it yields nothing.
+    """
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._decided = asyncio.Event()
+        self.released = False
+        self.closed = False
+
+    def put(self, token):
+        if not self.closed:
+            self._queue.put_nowait(token)
+
+    def release(self):
+        """Let buffered and future tokens through to the reader."""
+        self.released = True
+        self._decided.set()
+
+    def close(self):
+        """Mark the end of the reply; safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            self._queue.put_nowait(None)
+            self._decided.set()
+
+    async def __aiter__(self):
+        await self._decided.wait()
+        if not self.released:
+            return
+        while True:
+            token = await self._queue.get()
+            if token is None:
+                return
+            yield token
+
+
+def sse_event(event, data):
+    """Format a server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
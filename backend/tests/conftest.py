@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules import their siblings directly, as they do under app.wsgi
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,177 @@
+import asyncio
+
+import httpx
+import pytest
+
+import scheduler
+from backend_pool import BackendPool, NoBackendAvailable, CLOSED, OPEN, HALF_OPEN, is_server_fault
+from ollama_client import OllamaClient
+
+URLS = ['http://a/api/chat', 'http://b/api/chat']
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def fail(pool, backend, error):
+    with pytest.raises(httpx.HTTPError):
+        with pool.track(backend):
+            raise error
+
+
+def status_error(status):
+    request = httpx.Request('POST', URLS[0])
+    return httpx.HTTPStatusError('error', request=request, response=httpx.Response(status, request=request))
+
+
+def test_pick_prefers_the_least_loaded_backend():
+    pool = BackendPool(URLS)
+    a, b = pool.backends
+    a.outstanding = 2
+    assert pool.pick() is b
+    assert pool.pick(exclude=(b,)) is a
+
+
+def test_breaker_opens_after_consecutive_failures_then_lets_one_trial_through():
+    pool = BackendPool(URLS[:1], failure_threshold=2, reset_timeout=0.05)
+    backend = pool.backends[0]
+    fail(pool, backend, httpx.ConnectError('refused'))
+    assert backend.state == CLOSED
+    fail(pool, backend, httpx.ConnectError('refused'))
+    assert backend.state == OPEN
+    with pytest.raises(NoBackendAvailable):
+        pool.pick()
+
+    run(asyncio.sleep(0.06))
+    assert pool.pick() is backend and backend.state == HALF_OPEN
+    with pool.track(backend):
+        with pytest.raises(NoBackendAvailable):
+            pool.pick()  # Only one trial call at a time
+    assert backend.state == CLOSED
+
+
+def test_failed_trial_reopens_the_breaker():
+    pool = BackendPool(URLS[:1], failure_threshold=1, reset_timeout=0)
+    backend = pool.backends[0]
+    fail(pool, backend, status_error(503))
+    pool.pick()
+    fail(pool, backend, status_error(503))
+    assert backend.state == OPEN
+
+
+@pytest.mark.parametrize('error, cut_short, counted', [
+    (status_error(500), False, True),
+    (status_error(404), False, False),
+    (status_error(400), False, False),
+    (httpx.ConnectError('refused'), False, True),
+    (httpx.ReadTimeout('slow'), False, True),
+    (httpx.ReadTimeout('slow'), True, False),
+    (httpx.ConnectTimeout('slow'), True, True),
+    (httpx.PoolTimeout('busy'), False, False),
+])
+def test_only_server_faults_count_against_the_breaker(error, cut_short, counted):
+    assert is_server_fault(error, cut_short) is counted
+    pool = BackendPool(URLS[:1], failure_threshold=1)
+    with pytest.raises(httpx.HTTPError):
+        with pool.track(pool.backends[0], cut_short):
+            raise error
+    assert (pool.backends[0].state == OPEN) is counted
+
+
+def test_health_checks_never_close_the_breaker():
+    async def main():
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json={'version': 'test'}))
+        async with httpx.AsyncClient(transport=transport) as client:
+            pool = BackendPool(URLS[:1], failure_threshold=1, reset_timeout=0.05)
+            backend = pool.backends[0]
+            fail(pool, backend, status_error(500))
+            await pool.check_health(client)
+            assert backend.state == OPEN  # Not before reset_timeout
+            await asyncio.sleep(0.06)
+            await pool.check_health(client)
+            assert backend.state == HALF_OPEN  # Up for a trial call, but not back in rotation
+
+    run(main())
+
+
+def test_failed_health_check_ejects_a_backend():
+    async def main():
+        transport = httpx.MockTransport(lambda request: httpx.Response(500))
+        async with httpx.AsyncClient(transport=transport) as client:
+            pool = BackendPool(URLS[:1])
+            await pool.check_health(client)
+            assert pool.backends[0].state == OPEN
+
+    run(main())
+
+
+def test_deadline_shortened_timeouts_are_flagged():
+    ollama = OllamaClient(URLS, timeout=30.0)
+    assert ollama._timeout(None) == (httpx.USE_CLIENT_DEFAULT, False)
+
+    async def main():
+        with scheduler.deadline(1.0):
+            timeout, cut_short = ollama._timeout(None)
+            assert cut_short and timeout.read <= 1.0
+            assert ollama._timeout(0.5)[1] is False
+
+    run(main())
+
+
+def hedging_client(handler, hedge_delay=0.05):
+    """An OllamaClient on the running loop whose servers are answered by `handler`."""
+    ollama = OllamaClient(URLS, hedge_delay=hedge_delay, health_interval=None, max_concurrency=2)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    queue = scheduler.RequestScheduler(ollama.max_concurrency * len(URLS))
+    ollama._clients[asyncio.get_running_loop()] = (client, queue, None)
+    return ollama, queue
+
+
+def test_slow_call_is_hedged_and_the_backup_wins():
+    calls = []
+
+    async def handler(request):
+        calls.append(str(request.url))
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+        return httpx.Response(200, json={'server': str(request.url)})
+
+    async def main():
+        ollama, queue = hedging_client(handler)
+        response = await ollama.chat({'messages': []}, hedge=True)
+        assert len(set(calls)) == 2 and response == {'server': calls[1]}
+        assert (ollama.hedges_sent, ollama.hedges_won) == (1, 1)
+        assert queue.in_flight == 0  # The hedge's extra slot is given back
+        await asyncio.sleep(0)  # Let the cancelled loser unwind
+        assert all(backend.outstanding == 0 for backend in ollama.pool.backends)
+
+    run(main())
+
+
+def test_fast_call_is_not_hedged():
+    async def handler(request):
+        return httpx.Response(200, json={'server': str(request.url)})
+
+    async def main():
+        ollama, queue = hedging_client(handler)
+        await ollama.chat({'messages': []}, hedge=True)
+        assert ollama.hedges_sent == 0 and queue.in_flight == 0
+
+    run(main())
+
+
+def test_failed_call_inside_the_hedge_delay_fails_over():
+    calls = []
+
+    async def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(500 if len(calls) == 1 else 200, json={'server': str(request.url)})
+
+    async def main():
+        ollama, queue = hedging_client(handler, hedge_delay=1.0)
+        response = await ollama.chat({'messages': []}, hedge=True)
+        assert response == {'server': calls[1]} and calls[0] != calls[1]
+        assert ollama.hedges_sent == 0
+
+    run(main())
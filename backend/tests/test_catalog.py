@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+from catalog import Catalog
+
+
+def record(sku, list_price=1500, min_price=1200):
+    return json.dumps({'sku': sku, 'name': sku, 'list_price': list_price, 'min_price': min_price}) + '\n'
+
+
+def test_products_appended_after_a_miss_are_found(tmp_path):
+    path = tmp_path / 'catalog.jsonl'
+    path.write_text(record('a') + record('b'))
+    catalog = Catalog(str(path))
+    assert catalog.get('c') is None  # Scans the whole file
+    with open(path, 'a') as f:
+        f.write(record('c', 900, 800))
+    assert catalog.get('c').list_price == 900
+    assert catalog.get('b').sku == 'b'  # Indexed on the earlier scan
+
+
+def test_partly_written_line_is_read_once_complete(tmp_path):
+    path = tmp_path / 'catalog.jsonl'
+    line = record('a')
+    path.write_text(line[:20])
+    catalog = Catalog(str(path))
+    assert catalog.get('a') is None
+    path.write_text(line)
+    assert catalog.get('a').sku == 'a'
+
+
+def test_last_line_without_a_newline_is_read(tmp_path):
+    path = tmp_path / 'catalog.jsonl'
+    path.write_text(record('a') + record('b').rstrip('\n'))
+    assert Catalog(str(path)).get('b').sku == 'b'
+
+
+def test_fetch_serves_cached_products_and_loads_the_rest(tmp_path):
+    path = tmp_path / 'catalog.jsonl'
+    path.write_text(record('a'))
+    catalog = Catalog(str(path), compile_prompt=lambda product: f"Selling {product.name}")
+
+    async def main():
+        first = await catalog.fetch('a')
+        assert first.system_message == 'Selling a'
+        assert await catalog.fetch('a') is first
+        assert await catalog.fetch('missing') is None
+        assert await catalog.fetch('') is None
+
+    asyncio.run(main())
+    assert (catalog.loads, catalog.hits) == (1, 1)
@@ -0,0 +1,44 @@
+import pytest
+
+import fast_path
+
+
+@pytest.mark.parametrize('message, intent, price', [
+    ("£1,250", 'negotiation', 1250.0),
+    ("1250 GBP", 'negotiation', 1250.0),
+    ("How about £1.25k?", 'negotiation', 1250.0),
+    ("1300.50", 'negotiation', 1300.5),
+    ("Deal!", 'acceptance', None),
+    ("No thanks.", 'rejection', None),
+])
+def test_confident_answers(message, intent, price):
+    result = fast_path.analyze(message)
+    assert (result.intent, result.price) == (intent, price)
+    assert result.confidence >= 0.8
+
+
+@pytest.mark.parametrize('message', [
+    "too expensive",  # Haggling, not walking away
+    "done",
+    "1,25",  # Not a well-formed thousands group
+    "I offer 1,2500",
+    "ok, 1200 then",  # An offer with a decision word, left to the LLM
+    "can you do 10% off?",  # Percentages aren't prices
+    "20% off?",
+    "5 percent off and it's yours at 1200",
+    "how about 15pc off",
+    "1 300",  # A space-split figure could be 1300 or 300
+    "£1 250",
+])
+def test_ambiguous_messages_go_to_the_llm(message):
+    assert fast_path.analyze(message).confidence < 0.8
+
+
+def test_several_figures_lower_confidence():
+    result = fast_path.analyze("You said 1,400 but I'd pay 1,300")
+    assert result.price == 1300.0
+    assert result.confidence < 0.8
+
+
+def test_single_digits_are_not_prices():
+    assert fast_path.extract_amounts("I need 4 wheels") == []
@@ -0,0 +1,22 @@
+from metrics import MetricsRegistry
+
+
+def test_running_totals_render_as_counters():
+    registry = MetricsRegistry(prefix='test')
+    registry.set_counter('hedges_sent_total', 3)
+    registry.set_counter('hedges_sent_total', 5)  # A fresh snapshot replaces the total rather than adding to it
+    registry.set_gauge('sessions_cached', 2)
+    text = registry.render()
+    assert '# TYPE test_hedges_sent_total counter\ntest_hedges_sent_total 5' in text
+    assert '# TYPE test_sessions_cached gauge\ntest_sessions_cached 2' in text
+
+
+def test_labelled_series_share_one_family():
+    registry = MetricsRegistry(prefix='test')
+    registry.describe('backend_requests_total', "Calls sent to each server.")
+    registry.set_counter('backend_requests_total', 4, backend='a')
+    registry.inc('backend_requests_total', backend='b')
+    text = registry.render()
+    assert text.count('# TYPE test_backend_requests_total counter') == 1
+    assert 'test_backend_requests_total{backend="a"} 4' in text
+    assert 'test_backend_requests_total{backend="b"} 1' in text
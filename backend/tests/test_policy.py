@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+from policy import ConcessionPolicy
+
+# The simulator lives with the other offline tools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks'))
+
+
+def test_counteroffers_concede_from_opening_to_floor():
+    policy = ConcessionPolicy(1200, 5, shape=1.0)
+    offers = [policy.counter(1500, attempt) for attempt in range(6)]
+    assert offers == [1500, 1425, 1350, 1275, 1200, 1200]
+
+
+@pytest.mark.parametrize('shape, early', [(0.5, 'faster'), (2.0, 'slower')])
+def test_shape_controls_when_to_concede(shape, early):
+    linear = ConcessionPolicy(1200, 5, shape=1.0).counter(1500, 1)
+    shaped = ConcessionPolicy(1200, 5, shape=shape).counter(1500, 1)
+    assert shaped < linear if early == 'faster' else shaped > linear
+
+
+def test_counteroffer_never_undercuts_the_buyer_or_the_floor():
+    policy = ConcessionPolicy(1200, 5)
+    assert policy.counter(1500, 3, best_buyer_offer=1390) == 1390
+    assert policy.counter(1100, 0) == 1200  # Opening below the floor
+    assert policy.counter(1500, 2, best_buyer_offer=1349.6) == 1350
+
+
+def test_accepts_offers_close_to_the_counteroffer():
+    policy = ConcessionPolicy(1200, 5, accept_within=0.02)
+    assert policy.accepts(1372, 1400)
+    assert not policy.accepts(1371, 1400)
+    assert not policy.accepts(None, 1400)
+
+
+def test_never_accepts_below_the_floor():
+    policy = ConcessionPolicy(1200, 5, accept_within=0.02)
+    assert policy.accepts(1200, 1200)
+    assert not policy.accepts(1199, 1200)  # Within 2% of the counteroffer, but under the floor
+
+
+def test_array_calls_match_scalar_calls_over_a_grid():
+    np = pytest.importorskip('numpy')
+    openings = np.array([1100.0, 1350.5, 1455.0, 1470.0, 1500.0])
+    bests = np.array([-np.inf, 1199.0, 1300.0, 1349.6, 1480.0])
+    for shape in (0.5, 1.0, 2.0):
+        for accept_within in (0.0, 0.02, 0.05):
+            policy = ConcessionPolicy(1200, 5, shape=shape, accept_within=accept_within)
+            for attempt in range(7):
+                counters = policy.counter(openings[:, None], attempt, bests[None, :])
+                accepted = policy.accepts(bests[None, :], counters)
+                for i, opening in enumerate(openings):
+                    for j, best in enumerate(bests):
+                        scalar = policy.counter(float(opening), attempt, None if best == -np.inf else float(best))
+                        assert counters[i, j] == scalar
+                        assert accepted[i, j] == policy.accepts(float(best), scalar)
+
+
+def test_simulator_follows_the_policy_buyer_by_buyer():
+    np = pytest.importorskip('numpy')
+    import simulate_policy
+
+    rng = np.random.default_rng(1)
+    buyers = simulate_policy.make_buyers(rng, 500, 1500.0, 1320.0, 0.08)
+    policy = ConcessionPolicy(1200, simulate_policy.MAX_ATTEMPTS, shape=1.5, accept_within=0.02)
+    deal = simulate_policy.simulate(policy, buyers, walk_away=0.1, seed=2)
+
+    # Replay each buyer one turn at a time with plain numbers, drawing walk-aways in the simulator's order
+    walks = np.random.default_rng(2).random((policy.max_attempts, 500)) < 0.1
+    for i in range(500):
+        reservation, offer = buyers['reservation'][i], buyers['first_offer'][i]
+        opening = float(buyers['opening'][i])
+        current, best, expected = policy.counter(opening, 0), None, None
+        for attempt in range(1, policy.max_attempts + 1):
+            if current <= reservation:
+                expected = current
+                break
+            if walks[attempt - 1, i]:
+                break
+            proposal = policy.counter(opening, attempt, best)
+            if policy.accepts(offer, proposal):
+                expected = offer
+                break
+            if attempt >= policy.max_attempts:
+                break
+            current = proposal
+            best = offer if best is None else max(best, offer)
+            offer = offer + buyers['concession'][i] * (reservation - offer)
+        assert (np.isnan(deal[i]) and expected is None) or deal[i] == pytest.approx(expected)
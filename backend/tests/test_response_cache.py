@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from response_cache import ResponseCache
+
+
+def test_miss_then_hit():
+    cache = ResponseCache()
+    key = ResponseCache.key({'model': 'm', 'messages': [{'role': 'user', 'content': 'hi'}]})
+    assert cache.get(key) is None
+    cache.set(key, {'message': {'content': 'hello'}})
+    assert cache.get(key) == {'message': {'content': 'hello'}}
+    stats = cache.snapshot()
+    assert (stats['memory_hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_key_ignores_dict_order():
+    assert ResponseCache.key({'a': 1, 'b': 2}) == ResponseCache.key({'b': 2, 'a': 1})
+    assert ResponseCache.key({'a': 1}) != ResponseCache.key({'a': 2})
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the oldest
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_expired_entries_are_misses():
+    cache = ResponseCache(ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_sqlite_round_trip(tmp_path):
+    db_path = str(tmp_path / 'responses.db')
+    cache = ResponseCache(db_path=db_path, namespace='model-a')
+    cache.set('a', {'message': {'content': 'hello'}})
+    cache.flush()
+
+    restarted = ResponseCache(db_path=db_path, namespace='model-a')
+    assert asyncio.run(restarted.fetch('a')) == {'message': {'content': 'hello'}}
+    assert restarted.snapshot()['disk_hits'] == 1
+    assert restarted.get('a') == {'message': {'content': 'hello'}}
+    assert restarted.snapshot()['memory_hits'] == 1  # Promoted to memory by the disk hit
+
+
+def test_rows_of_another_model_are_purged(tmp_path):
+    db_path = str(tmp_path / 'responses.db')
+    cache = ResponseCache(db_path=db_path, namespace='model-a')
+    cache.set('a', 1)
+    cache.flush()
+
+    assert ResponseCache(db_path=db_path, namespace='model-b').get('a') is None
+    assert ResponseCache(db_path=db_path, namespace='model-a').get('a') is None
+
+
+def test_set_does_not_wait_for_disk(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / 'responses.db'), max_entries=1)
+    cache.get('warm-up')  # Opens the file and starts the writer
+    with cache._writer_lock:  # Hold the writer, as a slow commit would
+        started = time.monotonic()
+        cache.set('a', 1)
+        cache.set('b', 2)  # Pushes 'a' out of memory before it is written
+        assert time.monotonic() - started < 0.5
+        assert cache.get('a') == 1  # Served from the write queue
+    cache.flush()
+    assert cache.get('b') == 2
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import RequestScheduler, QueueFull, DeadlineExceeded, PRIORITY_CHAT, PRIORITY_AUX, PRIORITY_BACKGROUND
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def hold(queue, priority, started, order, release):
+    async with queue.slot(priority):
+        order.append(priority)
+        started.set()
+        await release.wait()
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def main():
+        queue = RequestScheduler(max_concurrency=1)
+        order = []
+        gate = asyncio.Event()
+        first = asyncio.create_task(hold(queue, PRIORITY_AUX, asyncio.Event(), order, gate))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.create_task(hold(queue, priority, asyncio.Event(), order, gate))
+            for priority in (PRIORITY_BACKGROUND, PRIORITY_AUX, PRIORITY_CHAT)
+        ]
+        await asyncio.sleep(0)
+        assert queue.queue_depth == 3
+        gate.set()
+        await asyncio.gather(first, *waiters)
+        assert order == [PRIORITY_AUX, PRIORITY_CHAT, PRIORITY_AUX, PRIORITY_BACKGROUND]
+        assert queue.in_flight == 0
+
+    run(main())
+
+
+def test_full_queue_sheds_the_lowest_priority_waiter():
+    async def main():
+        queue = RequestScheduler(max_concurrency=1, max_queue=1)
+        gate = asyncio.Event()
+        running = asyncio.create_task(hold(queue, PRIORITY_AUX, asyncio.Event(), [], gate))
+        await asyncio.sleep(0)
+        background = asyncio.create_task(hold(queue, PRIORITY_BACKGROUND, asyncio.Event(), [], gate))
+        await asyncio.sleep(0)
+        assert queue.overloaded()
+
+        chat = asyncio.create_task(hold(queue, PRIORITY_CHAT, asyncio.Event(), [], gate))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await background
+
+        # Nothing ranks below a chat call, so the next one is turned away
+        with pytest.raises(QueueFull):
+            await hold(queue, PRIORITY_CHAT, asyncio.Event(), [], gate)
+
+        gate.set()
+        await asyncio.gather(running, chat)
+        assert queue.snapshot()['rejected_queue_full'] == 2
+        assert queue.in_flight == 0
+
+    run(main())
+
+
+def test_deadline_rejects_waiting_and_late_requests():
+    async def main():
+        queue = RequestScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        running = asyncio.create_task(hold(queue, PRIORITY_AUX, asyncio.Event(), [], gate))
+        await asyncio.sleep(0)
+        with scheduler.deadline(0.05):
+            with pytest.raises(DeadlineExceeded):
+                await hold(queue, PRIORITY_CHAT, asyncio.Event(), [], gate)
+        assert queue.queue_depth == 0
+
+        with scheduler.deadline(-1):
+            with pytest.raises(DeadlineExceeded):
+                await hold(queue, PRIORITY_CHAT, asyncio.Event(), [], gate)
+
+        gate.set()
+        await running
+        assert queue.snapshot()['rejected_deadline'] == 2
+        assert queue.in_flight == 0
+
+    run(main())
+
+
+def test_nested_deadline_keeps_the_earlier_one():
+    with scheduler.deadline(1):
+        with scheduler.deadline(60):
+            assert scheduler.remaining() <= 1
+    assert scheduler.remaining() is None
+
+
+def test_cancelled_waiter_passes_on_a_slot_handed_to_it():
+    async def main():
+        queue = RequestScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        gate.set()
+        order = []
+        assert queue.try_acquire()
+        doomed = asyncio.create_task(hold(queue, PRIORITY_CHAT, asyncio.Event(), order, gate))
+        later = asyncio.create_task(hold(queue, PRIORITY_BACKGROUND, asyncio.Event(), order, gate))
+        await asyncio.sleep(0)
+
+        # Hand the slot to `doomed`, then cancel it before it gets to run
+        queue.release()
+        doomed.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await doomed
+        await later
+        assert order == [PRIORITY_BACKGROUND]
+        assert queue.in_flight == 0
+
+    run(main())
+
+
+def test_try_acquire_only_takes_an_idle_slot():
+    async def main():
+        queue = RequestScheduler(max_concurrency=1)
+        assert queue.try_acquire()
+        assert not queue.try_acquire()
+        queue.release()
+        assert queue.in_flight == 0
+
+    run(main())
+
+
+def test_resize_admits_waiters_or_retires_slots():
+    async def main():
+        queue = RequestScheduler(max_concurrency=2)
+        assert queue.try_acquire() and queue.try_acquire()
+        order = []
+        gate = asyncio.Event()
+        gate.set()
+        waiter = asyncio.create_task(hold(queue, PRIORITY_AUX, asyncio.Event(), order, gate))
+        await asyncio.sleep(0)
+
+        # Shrinking retires the next freed slot instead of handing it over
+        queue.resize(1)
+        queue.release()
+        await asyncio.sleep(0)
+        assert order == [] and queue.in_flight == 1
+
+        # Growing admits the waiter straight away
+        queue.resize(2)
+        await waiter
+        assert order == [PRIORITY_AUX]
+        queue.release()
+        assert queue.in_flight == 0
+
+    run(main())
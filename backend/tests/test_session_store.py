@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from session_store import SessionStore
+
+
+class Product:
+    def __init__(self, sku):
+        self.sku = sku
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'sessions.db')
+
+
+def make_store(db_path, **kwargs):
+    # Each store has its own connections, like a separate worker process sharing the file
+    return SessionStore(db_path=db_path, resolve_product=Product, **kwargs)
+
+
+def take_turn(store, session, attempts):
+    session.attempts = attempts
+    session.history.append({'role': 'user', 'content': f"turn {attempts}"})
+    return store.save(session).result(timeout=5)
+
+
+def test_memory_only_store_never_touches_disk():
+    store = SessionStore()
+    session = store.create()
+    assert store.save(session) is None
+    assert store.get(session.session_id) is session
+    store.discard(session.session_id)
+    assert store.get(session.session_id) is None
+
+
+def test_unwritable_file_falls_back_to_memory(tmp_path):
+    blocker = tmp_path / 'not-a-directory'
+    blocker.write_text('')
+    store = make_store(str(blocker / 'sessions.db'))
+    assert not store.persistent
+    session = store.create()
+    assert store.save(session) is None
+    assert store.get(session.session_id) is session
+
+
+def test_other_worker_sees_saved_turns(db_path):
+    a, b = make_store(db_path), make_store(db_path)
+    session = a.create()
+    session.product = Product('WHEELS-4')
+    assert take_turn(a, session, 1)
+
+    loaded = b.get(session.session_id)
+    assert loaded.attempts == 1 and loaded.product.sku == 'WHEELS-4'
+    assert take_turn(b, loaded, 2)
+
+    # a's cached copy is out of date, so it is reloaded
+    reloaded = a.get(session.session_id)
+    assert reloaded is not session
+    assert reloaded.attempts == 2 and len(reloaded.history) == 2
+    assert a.snapshot()['stale_reloads'] == 1
+
+
+def test_concurrent_writes_from_the_same_version_conflict(db_path):
+    a, b = make_store(db_path), make_store(db_path)
+    session = a.create()
+    assert take_turn(a, session, 1)
+    theirs = b.get(session.session_id)
+
+    # Both workers start from the same version; only the first write lands
+    assert take_turn(b, theirs, 2)
+    assert not take_turn(a, session, 5)
+    assert a.snapshot()['conflicts'] == 1
+
+    # The losing worker drops its copy and picks up the winner's
+    assert a.get(session.session_id).attempts == 2
+    assert take_turn(a, a.get(session.session_id), 3)
+    assert b.get(session.session_id).attempts == 3
+
+
+def test_unwritten_saves_are_served_from_the_queue(db_path):
+    store = make_store(db_path, max_sessions=1, stripes=1)
+    first = store.create()
+    assert take_turn(store, first, 1)
+    with store._writer_lock:  # Hold the writer back
+        first.attempts = 4
+        saved = store.save(first)
+        store.create()  # Evicts `first` from memory
+        assert store.get(first.session_id).attempts == 4
+    assert saved.result(timeout=5)
+
+
+def test_discard_is_seen_by_other_workers(db_path):
+    a, b = make_store(db_path), make_store(db_path)
+    session = a.create()
+    assert take_turn(a, session, 1)
+    assert b.get(session.session_id) is not None
+    a.discard(session.session_id)
+    a.flush()  # Returns once the delete is written, whichever thread writes it
+    assert b.get(session.session_id) is None
+
+
+def test_compaction_deletes_expired_sessions(db_path):
+    store = make_store(db_path, ttl=0.2)
+    session = store.create()
+    assert take_turn(store, session, 1)
+    time.sleep(0.3)
+    store.compact()
+    assert store.snapshot()['compacted'] == 1
+    assert store.get(session.session_id) is None
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+
+from backend_pool import OPEN
+
+
+class ModelWarmer:
+    """
+    Loads the model on every Ollama server ahead of the first buyer and keeps it loaded.
+
+    A warm-up call sends `prime_messages` (the static system prompt) with a
+    one-token completion, which loads the model, pins it for `keep_alive` and
+    leaves the prompt's evaluated prefix in Ollama's cache. After the first
+    round, servers that have gone `interval` seconds without a successful call
+    are warmed again, so an idle spell or an Ollama restart doesn't turn the
+    next greeting into a cold start. A server that has never been warm is
+    retried every `retry_interval` seconds instead.
+    """
+
+    def __init__(self, ollama, model, keep_alive, prime_messages=(), interval=240.0, timeout=120.0,
+                 retry_interval=15.0):
+        self.ollama = ollama
+        self.model = model
+        self.keep_alive = keep_alive
+        self.prime_messages = list(prime_messages)
+        self.interval = interval
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.warmed = {}  # url -> monotonic time of the last successful warm-up
+        self._task = None
+
+    def payload(self):
+        return {
+            "model": self.model,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_predict": 1},
+            "messages": self.prime_messages
+        }
+
+    async def warm(self, backends=None):
+        """Warm `backends`, or every server, returning whether the model is ready anywhere."""
+        started = time.monotonic()
+        results = await self.ollama.broadcast(self.payload(), backends, timeout=self.timeout)
+        for url, error in results.items():
+            if error is None:
+                self.warmed[url] = time.monotonic()
+                logging.info(f"Warmed {self.model} on {url} in {time.monotonic() - started:.2f}s")
+            else:
+                self.warmed.pop(url, None)
+                logging.warning(f"Failed to warm {self.model} on {url}: {error!r}")
+        return self.ready
+
+    async def start(self):
+        """Warm every server, then keep re-warming idle ones in the background. Returns after the first round."""
+        await self.warm()
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.get_loop() is not loop:  # Not yet started in this process
+            self._task = loop.create_task(self._rewarm())
+
+    def _last_warm(self, backend):
+        # Any successful call leaves the model loaded, not just a warm-up
+        return max(backend.last_success, self.warmed.get(backend.url, 0.0))
+
+    async def _rewarm(self):
+        while True:
+            cold = any(not self._last_warm(backend) for backend in self.ollama.pool.backends)
+            await asyncio.sleep(min(self.interval, self.retry_interval) if cold else self.interval)
+            now = time.monotonic()
+            idle = [
+                backend for backend in self.ollama.pool.backends
+                if not self._last_warm(backend) or now - self._last_warm(backend) >= self.interval
+            ]
+            if idle:
+                try:
+                    await self.warm(idle)
+                except Exception as e:
+                    logging.error(f"Error re-warming {self.model}: {e}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def ready(self):
+        """Whether the model is loaded on at least one server still in rotation."""
+        return any(backend.state != OPEN and self._last_warm(backend) for backend in self.ollama.pool.backends)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            backend.url: {
+                'warm': bool(self._last_warm(backend)),
+                'seconds_since_warm': round(now - self._last_warm(backend), 1) if self._last_warm(backend) else None,
+                'state': backend.state,
+            }
+            for backend in self.ollama.pool.backends
+        }
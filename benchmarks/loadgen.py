@@ -0,0 +1,291 @@
+"""
+Load generator for the negotiator's HTTP endpoints.
+
+Drives /initialize and /chatbot (or /chatbot/stream) with many concurrent
+simulated buyers, each haggling in the price formats real buyers use until
+the negotiation closes. Prints throughput plus p50/p95/p99 latency per
+endpoint, and, when pointed at benchmarks/mock_ollama.py, the number of LLM
+calls per turn and the prompt tokens per call, broken down by kind.
+
+    python benchmarks/mock_ollama.py &
+    uvicorn asgi:application --app-dir backend --port 5000 &
+    python benchmarks/loadgen.py --buyers 200 --concurrency 50
+
+Thresholds such as --max-llm-calls-per-turn and --max-p95 make the run exit
+non-zero, so it can gate a deploy.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import httpx
+
+OFFER_FORMATS = [
+    "how about {price}?",
+    "£{price:,}",
+    "I can do {price} GBP",
+    "what about {price} quid",
+    "{thousands}k",
+    "{price}",
+    "Would you take £{price} for them?",
+]
+BUSY_RETRY_SECONDS = 1.0
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}  # endpoint -> [seconds]
+        self.first_token = []  # seconds until the first streamed token
+        self.errors = 0
+        self.busy = 0  # Turns the server turned away as too busy, then retried
+        self.turns = 0
+        self.deals = 0
+        self.buyers = 0
+
+    def record(self, endpoint, seconds):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+
+
+async def post_chat(client, base_url, message, session_id, stream, results):
+    """Send one /chatbot turn and return the decoded response body."""
+    body = {'message': message, 'session_id': session_id}
+    start = time.perf_counter()
+    if not stream:
+        response = await client.post(f"{base_url}/chatbot", json=body)
+        results.record('/chatbot', time.perf_counter() - start)
+        return response.json()
+
+    data = None
+    async with client.stream('POST', f"{base_url}/chatbot/stream", json=body) as response:
+        if not response.headers.get('content-type', '').startswith('text/event-stream'):
+            data = json.loads(await response.aread())
+        else:
+            event = None
+            saw_token = False
+            async for line in response.aiter_lines():
+                if line.startswith('event: '):
+                    event = line[7:]
+                elif line.startswith('data: '):
+                    if event == 'token' and not saw_token:
+                        saw_token = True
+                        results.first_token.append(time.perf_counter() - start)
+                    elif event == 'done':
+                        data = json.loads(line[6:])
+    results.record('/chatbot/stream', time.perf_counter() - start)
+    return data
+
+
+async def run_buyer(client, base_url, stream, max_turns, results):
+    """One buyer negotiating until the bot closes the deal or they give up."""
+    target = random.randint(1150, 1420)
+    offer = random.randint(900, 1150)
+
+    start = time.perf_counter()
+    response = await client.post(f"{base_url}/initialize", json={'message': "Hi!"})
+    results.record('/initialize', time.perf_counter() - start)
+    data = response.json()
+    if data.get('busy'):
+        results.busy += 1
+        return
+    session_id = data.get('session_id')
+    bot_price = data.get('last_negotiated_price')
+
+    for _ in range(max_turns):
+        if bot_price is not None and bot_price <= target:
+            message = random.choice(["Deal!", "deal", "yes please", "ok"])
+        else:
+            offer = min(target, offer + random.randint(20, 80))
+            message = random.choice(OFFER_FORMATS).format(price=offer, thousands=f"{round(offer, -1) / 1000:g}")
+
+        data = await post_chat(client, base_url, message, session_id, stream, results)
+        results.turns += 1
+        if data is None:
+            results.errors += 1
+            return
+        if data.get('busy'):
+            results.busy += 1
+            await asyncio.sleep(BUSY_RETRY_SECONDS)
+            continue
+        if data.get('show_buttons'):
+            final_price = data.get('last_negotiated_price')
+            accept = final_price is not None and final_price <= target
+            await post_chat(client, base_url, "Deal!" if accept else "No Deal!", session_id, stream, results)
+            results.turns += 1
+            results.deals += accept
+            return
+        if data.get('last_negotiated_price') is None:
+            results.deals += 1  # Closing a deal resets the session's price
+            return
+        bot_price = data.get('last_negotiated_price')
+
+
+async def mock_stats(client, mock_urls, reset=False):
+    """Call and prompt token counts summed over every mock in the comma-separated `mock_urls`."""
+    totals = None
+    for mock_url in filter(None, mock_urls.split(',')):
+        try:
+            response = await (client.post if reset else client.get)(f"{mock_url}/stats")
+            stats = response.json()
+        except httpx.HTTPError:
+            continue
+        totals = totals or {'calls': {}, 'prompt_tokens': {}, 'prompt_chars': {}, 'peak_in_flight': 0, 'calls_by_mock': {}}
+        for field in ('calls', 'prompt_tokens', 'prompt_chars'):
+            for kind, count in stats.get(field, {}).items():
+                totals[field][kind] = totals[field].get(kind, 0) + count
+        totals['calls_by_mock'][mock_url] = sum(stats['calls'].values())
+        totals['peak_in_flight'] += stats['peak_in_flight']  # An upper bound across mocks
+    return totals
+
+
+async def run(args):
+    results = Results()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        await mock_stats(client, args.mock_url, reset=True)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def buyer():
+            async with semaphore:
+                try:
+                    await run_buyer(client, args.base_url, args.stream, args.max_turns, results)
+                except (httpx.HTTPError, ValueError):
+                    results.errors += 1
+                results.buyers += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(buyer() for _ in range(args.buyers)))
+        elapsed = time.perf_counter() - start
+        stats = await mock_stats(client, args.mock_url)
+    return results, elapsed, stats
+
+
+def build_report(results, elapsed, stats):
+    requests_made = sum(len(samples) for samples in results.latencies.values())
+    report = {
+        'elapsed_seconds': round(elapsed, 3),
+        'buyers': results.buyers,
+        'turns': results.turns,
+        'deals': results.deals,
+        'errors': results.errors,
+        'busy': results.busy,
+        'requests_per_second': round(requests_made / elapsed, 2) if elapsed else 0.0,
+        'turns_per_second': round(results.turns / elapsed, 2) if elapsed else 0.0,
+        'endpoints': {
+            endpoint: {
+                'count': len(samples),
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(samples, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 1),
+            }
+            for endpoint, samples in sorted(results.latencies.items())
+        },
+    }
+    if results.first_token:
+        report['time_to_first_token'] = {
+            'p50_ms': round(percentile(results.first_token, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(results.first_token, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(results.first_token, 0.99) * 1000, 1),
+        }
+    if stats is not None:
+        # /initialize runs a turn too, so count it alongside the /chatbot turns
+        turns = results.turns + len(results.latencies.get('/initialize', []))
+        calls = stats.get('calls', {})
+        report['llm'] = {
+            'calls': calls,
+            'calls_per_turn': round(sum(calls.values()) / turns, 3) if turns else 0.0,
+            'calls_per_turn_by_kind': {kind: round(count / turns, 3) for kind, count in calls.items()} if turns else {},
+            'prompt_tokens_per_call_by_kind': {
+                kind: round(tokens / calls[kind], 1) for kind, tokens in stats.get('prompt_tokens', {}).items() if calls.get(kind)
+            },
+            # Checks the app's characters-per-token budget estimate against the mock's token counts
+            'prompt_chars_per_token_by_kind': {
+                kind: round(chars / stats['prompt_tokens'][kind], 2)
+                for kind, chars in stats.get('prompt_chars', {}).items() if stats['prompt_tokens'].get(kind)
+            },
+            'peak_in_flight': stats.get('peak_in_flight'),
+            'calls_by_mock': stats.get('calls_by_mock', {}),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{report['buyers']} buyers, {report['turns']} turns, {report['deals']} deals, "
+          f"{report['errors']} errors, {report['busy']} busy in {report['elapsed_seconds']}s")
+    print(f"Throughput: {report['requests_per_second']} req/s, {report['turns_per_second']} turns/s")
+    print(f"{'endpoint':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<20}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    if 'time_to_first_token' in report:
+        row = report['time_to_first_token']
+        print(f"{'first token':<20}{'':>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    if 'llm' in report:
+        llm = report['llm']
+        by_kind = ', '.join(f"{kind} {rate}" for kind, rate in sorted(llm['calls_per_turn_by_kind'].items()))
+        print(f"LLM calls per turn: {llm['calls_per_turn']} ({by_kind})")
+        tokens = llm['prompt_tokens_per_call_by_kind']
+        if tokens:
+            chars = llm['prompt_chars_per_token_by_kind']
+            print("Prompt tokens per call: " + ', '.join(
+                f"{kind} {count} ({chars.get(kind)} chars/token)" for kind, count in sorted(tokens.items())
+            ))
+        print(f"Peak concurrent LLM calls: {llm['peak_in_flight']}")
+        if len(llm['calls_by_mock']) > 1:
+            print("Calls per mock: " + ', '.join(f"{url} {count}" for url, count in llm['calls_by_mock'].items()))
+
+
+def check_thresholds(report, args):
+    failures = []
+    if args.max_llm_calls_per_turn is not None and 'llm' in report:
+        if report['llm']['calls_per_turn'] > args.max_llm_calls_per_turn:
+            failures.append(f"LLM calls per turn {report['llm']['calls_per_turn']} > {args.max_llm_calls_per_turn}")
+    if args.max_p95 is not None:
+        for endpoint, row in report['endpoints'].items():
+            if row['p95_ms'] > args.max_p95:
+                failures.append(f"{endpoint} p95 {row['p95_ms']}ms > {args.max_p95}ms")
+    if args.max_error_rate is not None and report['turns']:
+        if report['errors'] / report['buyers'] > args.max_error_rate:
+            failures.append(f"error rate {report['errors'] / report['buyers']:.3f} > {args.max_error_rate}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--mock-url', default='http://127.0.0.1:11434', help="Mock Ollamas to read call counts from, comma-separated, '' to skip")
+    parser.add_argument('--buyers', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--max-turns', type=int, default=8)
+    parser.add_argument('--stream', action='store_true', help="Use /chatbot/stream and report time to first token")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--json', metavar='PATH', help="Also write the report as JSON")
+    parser.add_argument('--max-llm-calls-per-turn', type=float)
+    parser.add_argument('--max-p95', type=float, help="Milliseconds")
+    parser.add_argument('--max-error-rate', type=float)
+    args = parser.parse_args()
+
+    results, elapsed, stats = asyncio.run(run(args))
+    report = build_report(results, elapsed, stats)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    failures = check_thresholds(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
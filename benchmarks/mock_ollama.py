@@ -0,0 +1,242 @@
+"""
+Local stand-in for Ollama's /api/chat, for benchmarking the negotiator without a model.
+
+Replies are scripted from the prompts app.py sends: the given counteroffer
+for the negotiation call, schema-shaped JSON for turn analysis, bare numbers or
+'No price found' for price extraction, intent words for classification and
+placeholder-preserving rewordings for the phrasing pool. Latency is drawn
+from a configurable distribution per kind of call.
+
+    python benchmarks/mock_ollama.py --port 11434 --chat-latency lognormal:0.8:0.4 --aux-latency uniform:0.1:0.3
+
+GET /stats returns call counts, prompt tokens and prompt characters per kind
+and the peak number of concurrent requests; POST /stats/reset zeroes them.
+Token counts come from a word-piece split rather than the app's own
+characters-per-token estimate, so the two can be compared. GET /api/version answers health
+checks. --error-rate and --stall-rate make a share of calls fail with a 500
+or hang, to exercise failover and hedging with several mocks:
+
+    python benchmarks/mock_ollama.py --port 11435 --stall-rate 0.05 &
+    python benchmarks/mock_ollama.py --port 11436 --error-rate 0.5 &
+    OLLAMA_API_URLS=http://127.0.0.1:11435/api/chat,http://127.0.0.1:11436/api/chat uvicorn asgi:application --app-dir backend
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+
+AMOUNT_RE = re.compile(r"£?\s?(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d{1,2}))?\s*(k\b)?", re.IGNORECASE)
+OFFER_RE = re.compile(r"Price to offer now: £?(\d[\d,]*(?:\.\d+)?)")
+TOKEN_RE = re.compile(r"\w{1,6}|[^\w\s]")  # Words split into pieces of up to six characters, punctuation alone
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and delimiter tokens the chat template adds per message
+ACCEPT_WORDS = ('deal', 'yes', 'sure', 'ok', 'agreed', 'accept')
+REJECT_WORDS = ('no deal', 'no thanks', 'not interested', "don't think so", 'no')
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution: 'fixed:S', 'uniform:LOW:HIGH' or 'lognormal:MEDIAN:SIGMA', in seconds.
+    Returns a function drawing one sample.
+    """
+    kind, *params = spec.split(':')
+    values = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median
+    raise ValueError(f"Unknown latency distribution {spec!r}")
+
+
+def last_amount(text):
+    matches = AMOUNT_RE.findall(text)
+    if not matches:
+        return None
+    number, decimals, k = matches[-1]
+    value = float(number.replace(',', '') + ('.' + decimals if decimals else ''))
+    return value * 1000 if k else value
+
+
+def count_tokens(messages):
+    """Approximate the prompt tokens a llama tokenizer produces for `messages`."""
+    return sum(len(TOKEN_RE.findall(m.get('content', ''))) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def intent_of(text):
+    text = text.lower()
+    if any(word in text for word in REJECT_WORDS[:-1]) or text.strip(' .!') == 'no':
+        return 'rejection'
+    if any(re.search(rf"\b{word}\b", text) for word in ACCEPT_WORDS):
+        return 'acceptance'
+    if last_amount(text) is not None:
+        return 'negotiation'
+    return 'unknown'
+
+
+def classify_call(payload):
+    """Work out which of app.py's prompts a request carries."""
+    messages = payload.get('messages', [])
+    system = messages[0]['content'] if messages and messages[0]['role'] == 'system' else ''
+    last = messages[-1]['content'] if messages else ''
+    if not messages or payload.get('options', {}).get('num_predict') == 1:
+        return 'warmup'
+    if 'price negotiator' in system:
+        return 'chat'
+    if 'analyzes the' in system:
+        return 'analysis'
+    if 'extracts the latest price' in system:
+        return 'extract_price'
+    if 'classifies the' in system:
+        return 'classify_intent'
+    if 'Keep every placeholder' in last:
+        return 'phrasing'
+    return 'other'
+
+
+class MockOllama:
+    def __init__(self, chat_latency, aux_latency, token_delay=0.01, malformed_rate=0.0,
+                 error_rate=0.0, stall_rate=0.0, stall_seconds=300.0):
+        self.chat_latency = chat_latency
+        self.aux_latency = aux_latency
+        self.token_delay = token_delay
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.prompt_tokens = {}
+        self.prompt_chars = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def reply(self, kind, payload):
+        messages = payload.get('messages', [])
+        last = messages[-1]['content'] if messages else ''
+
+        if kind == 'chat':
+            facts = messages[-1]['content'] if messages and messages[-1]['role'] == 'system' else ''
+            match = OFFER_RE.search(facts)
+            price = round(float(match.group(1).replace(',', ''))) if match else 1500
+            template = random.choice([
+                "I can offer you these for £{price}. How does that sound?",
+                "How about {price} GBP? That's a cracking price for quality like this.",
+                "Let's meet in the middle: £{price}, and that's a fine deal.",
+            ])
+            return template.format(price=price)
+        if kind == 'analysis':
+            if random.random() < self.malformed_rate:
+                return "The intent is negotiation"
+            return json.dumps({'intent': intent_of(last), 'price': last_amount(last)})
+        if kind == 'extract_price':
+            price = last_amount(last)
+            return 'No price found' if price is None else f"{price}"
+        if kind == 'classify_intent':
+            return intent_of(last)
+        if kind == 'phrasing':
+            template = last.split('respond with the sentence only: ', 1)[-1]
+            return random.choice(["Right then! ", "Lovely. ", "Brilliant! "]) + template
+        return "Hello!"
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        if scope['path'] == '/stats':
+            if scope['method'] == 'POST':
+                self.reset()
+            await send_json(send, {
+                'calls': self.calls,
+                'prompt_tokens': self.prompt_tokens,
+                'prompt_chars': self.prompt_chars,
+                'peak_in_flight': self.peak_in_flight,
+            })
+            return
+        if scope['path'] == '/api/version':
+            await send_json(send, {'version': 'mock'})
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        payload = json.loads(body or b'{}')
+
+        kind = classify_call(payload)
+        messages = payload.get('messages', [])
+        prompt_tokens = count_tokens(messages)
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        self.prompt_tokens[kind] = self.prompt_tokens.get(kind, 0) + prompt_tokens
+        self.prompt_chars[kind] = self.prompt_chars.get(kind, 0) + sum(len(m.get('content', '')) for m in messages)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            latency = self.chat_latency() if kind == 'chat' else self.aux_latency()
+            if random.random() < self.stall_rate:
+                latency = self.stall_seconds
+            await asyncio.sleep(max(0.0, latency))
+            if random.random() < self.error_rate:
+                await send_json(send, {'error': 'mock failure'}, 500)
+                return
+            content = self.reply(kind, payload)
+            final = {
+                'model': payload.get('model'),
+                'message': {'role': 'assistant', 'content': content},
+                'done': True,
+                'total_duration': int(latency * 1e9),
+                'prompt_eval_count': prompt_tokens,
+                'eval_count': len(TOKEN_RE.findall(content)),
+            }
+            if payload.get('stream'):
+                await self.stream(send, content, final)
+            else:
+                await send_json(send, final)
+        finally:
+            self.in_flight -= 1
+
+    async def stream(self, send, content, final):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/x-ndjson')]})
+        for token in re.findall(r"\S+\s*", content):
+            chunk = {'message': {'role': 'assistant', 'content': token}, 'done': False}
+            await send({'type': 'http.response.body', 'body': (json.dumps(chunk) + '\n').encode(), 'more_body': True})
+            await asyncio.sleep(self.token_delay)
+        final = {**final, 'message': {'role': 'assistant', 'content': ''}}
+        await send({'type': 'http.response.body', 'body': (json.dumps(final) + '\n').encode()})
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode()
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--chat-latency', default='lognormal:0.8:0.4', help="Latency of negotiation replies")
+    parser.add_argument('--aux-latency', default='lognormal:0.2:0.3', help="Latency of analysis, extraction and rephrasing calls")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="Fraction of turn analyses answered with invalid JSON")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls answered with a 500")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="Fraction of calls that hang for --stall-seconds")
+    parser.add_argument('--stall-seconds', type=float, default=300.0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    mock = MockOllama(
+        parse_latency(args.chat_latency), parse_latency(args.aux_latency), args.token_delay, args.malformed_rate,
+        args.error_rate, args.stall_rate, args.stall_seconds
+    )
+    uvicorn.run(mock, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Offline simulator for tuning the negotiator's concession policy.
+
+Plays backend/policy.py's ConcessionPolicy against millions of synthetic
+buyers at once with NumPy, following the same turn order as app.py: the
+opening offer, then each buyer either takes the current price, walks away or
+makes an offer, which the policy accepts or answers with a counteroffer until
+MAX_ATTEMPTS runs out. Each buyer has a private reservation price, an opening
+offer below it and a rate at which they concede towards it.
+
+Every combination of --shapes and --accept-within is scored on the same
+buyers. The report gives close rate, average deal price and margin over
+the floor price per buyer, so margin can be traded off against close rate:
+
+    python benchmarks/simulate_policy.py --buyers 2000000 --shapes 0.5,1,1.5,2,3 --accept-within 0,0.02,0.05
+
+Needs NumPy, which the service itself doesn't.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from policy import ConcessionPolicy  # noqa: E402
+
+# app.py's MAX_ATTEMPTS; prices default to the catalog's default product
+MAX_ATTEMPTS = 5
+
+
+def make_buyers(rng, n, list_price, reservation_median, reservation_sigma):
+    """Draw `n` synthetic buyers as arrays of their hidden parameters."""
+    reservation = reservation_median * rng.lognormal(0.0, reservation_sigma, n)
+    return {
+        'reservation': reservation,
+        'first_offer': reservation * rng.uniform(0.6, 0.9, n),
+        'concession': rng.uniform(0.03, 0.15, n),  # Share of the gap to their reservation price closed each turn
+        # Matches app.generate_random_discount: 2 to 5 percent off, in whole percent
+        'opening': np.round(list_price * (1 - np.round(rng.uniform(2, 5, n)) / 100), 2),
+    }
+
+
+def simulate(policy, buyers, walk_away, seed):
+    """Negotiate with every buyer under `policy`, returning each deal price, NaN where there was no deal."""
+    rng = np.random.default_rng(seed)  # Same walk-away draws for every policy
+    n = len(buyers['reservation'])
+    reservation = buyers['reservation']
+    opening = buyers['opening']
+    deal = np.full(n, np.nan)
+    active = np.ones(n, dtype=bool)
+    best = np.full(n, -np.inf)
+    offer = buyers['first_offer'].copy()
+
+    current = policy.counter(opening, 0, best)  # The greeting makes the opening offer
+    attempts = 1
+    while active.any():
+        # The buyer takes the current price if they can afford it...
+        takes = active & (current <= reservation)
+        deal[takes] = current[takes]
+        active &= ~takes
+        # ...or may give up...
+        active &= rng.random(n) >= walk_away
+        # ...or makes an offer, which is accepted if close enough to the next counteroffer
+        proposal = policy.counter(opening, attempts, best)
+        accepted = active & policy.accepts(offer, proposal)
+        deal[accepted] = offer[accepted]
+        active &= ~accepted
+        if attempts >= policy.max_attempts:
+            break  # The final offer is the current price, which the remaining buyers can't afford
+        current = np.where(active, proposal, current)
+        best = np.maximum(best, offer)
+        offer = offer + buyers['concession'] * (reservation - offer)
+        attempts += 1
+    return deal
+
+
+def score(deal, floor):
+    closed = ~np.isnan(deal)
+    prices = deal[closed]
+    return {
+        'close_rate': round(float(closed.mean()), 4),
+        'avg_deal_price': round(float(prices.mean()), 2) if prices.size else None,
+        'margin_per_buyer': round(float((prices - floor).sum() / deal.size), 2),
+        'revenue_per_buyer': round(float(prices.sum() / deal.size), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buyers', type=int, default=1_000_000)
+    parser.add_argument('--shapes', default='0.5,0.75,1,1.5,2,3', help="Concession curve shapes to try")
+    parser.add_argument('--accept-within', default='0,0.02,0.05', help="Acceptance margins to try")
+    parser.add_argument('--list-price', type=float, default=1500.0)
+    parser.add_argument('--min-price', type=float, default=1200.0, help="The product's floor price")
+    parser.add_argument('--reservation-median', type=float, default=1320.0, help="Median most a buyer will pay")
+    parser.add_argument('--reservation-sigma', type=float, default=0.08)
+    parser.add_argument('--walk-away', type=float, default=0.08, help="Chance a buyer gives up on each turn")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    buyers = make_buyers(rng, args.buyers, args.list_price, args.reservation_median, args.reservation_sigma)
+
+    results = []
+    start = time.perf_counter()
+    for shape in (float(s) for s in args.shapes.split(',')):
+        for accept_within in (float(a) for a in args.accept_within.split(',')):
+            policy = ConcessionPolicy(args.min_price, MAX_ATTEMPTS, shape=shape, accept_within=accept_within)
+            deal = simulate(policy, buyers, args.walk_away, args.seed + 1)
+            results.append({'shape': shape, 'accept_within': accept_within, **score(deal, args.min_price)})
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda row: row['margin_per_buyer'], reverse=True)
+    print(f"{len(results)} policies x {args.buyers:,} buyers in {elapsed:.2f}s")
+    print(f"{'shape':>6}{'accept':>8}{'close rate':>12}{'avg price':>11}{'margin/buyer':>14}{'revenue/buyer':>15}")
+    for row in results:
+        print(f"{row['shape']:>6}{row['accept_within']:>8}{row['close_rate']:>12}{row['avg_deal_price']:>11}"
+              f"{row['margin_per_buyer']:>14}{row['revenue_per_buyer']:>15}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
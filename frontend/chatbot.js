@@ -4,6 +4,8 @@ const chatbox = document.querySelector(".box");
 const dealButtons = document.getElementById("deal-buttons");  // Get the deal buttons div
 const dealBtn = document.getElementById("deal-btn");
 const noDealBtn = document.getElementById("no-deal-btn");
+let sessionId = null;  // Issued by the backend on /initialize, identifies this negotiation
+const productSku = new URLSearchParams(window.location.search).get("sku");  // Product to negotiate, the backend's default if absent
 
 sendChatBtn.addEventListener("click", () => {
     let userMessage = chatInput.value.trim();
@@ -63,30 +65,97 @@ function typeText(text, container) {
     typeChar();
 }
 
-function sendToBackend(message) {
-    fetch('http://127.0.0.1:5000/chatbot', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ message: message })
-    })
-        .then(response => response.json())
-        .then(data => {
-            const botMessage = data.response || "Sorry, no response!";
-            appendMessage("bot", botMessage, true);
+function createBotMessage() {
+    let messageDiv = document.createElement("div");
+    messageDiv.classList.add("item", "bot");
+    messageDiv.innerHTML = `
+        <div class="icon">🤖</div>
+    `;
 
-            // Show or hide deal buttons based on backend response
-            if (data.show_buttons) {
-                dealButtons.style.display = 'block';  // Show buttons if required
-            } else {
-                dealButtons.style.display = 'none';  // Hide buttons if not needed
-            }
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            appendMessage("bot", "Sorry, something went wrong!");
+    let messageContent = document.createElement("div");
+    messageContent.classList.add("msg");
+    let paragraph = document.createElement("p");
+    messageContent.appendChild(paragraph);
+
+    messageDiv.appendChild(messageContent);
+    chatbox.appendChild(messageDiv);
+    return paragraph;
+}
+
+function handleBotResponse(data, paragraph) {
+    const botMessage = data.response || "Sorry, no response!";
+    if (paragraph) {
+        paragraph.textContent = botMessage;  // The final response replaces the streamed draft
+        chatbox.scrollTop = chatbox.scrollHeight;
+    } else {
+        appendMessage("bot", botMessage, true);
+    }
+
+    // Show or hide deal buttons based on backend response
+    if (data.show_buttons) {
+        dealButtons.style.display = 'block';  // Show buttons if required
+    } else {
+        dealButtons.style.display = 'none';  // Hide buttons if not needed
+    }
+}
+
+async function sendToBackend(message) {
+    let paragraph = null;  // Created when the first token of the reply arrives
+    try {
+        const response = await fetch('http://127.0.0.1:5000/chatbot/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ message: message, session_id: sessionId })
         });
+
+        // Errors such as an expired session come back as plain JSON
+        if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+            handleBotResponse(await response.json(), null);
+            return;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            // Server-sent events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = "message";
+                let eventData = "";
+                rawEvent.split("\n").forEach(line => {
+                    if (line.startsWith("event: ")) {
+                        eventName = line.slice(7);
+                    } else if (line.startsWith("data: ")) {
+                        eventData += line.slice(6);
+                    }
+                });
+
+                const data = JSON.parse(eventData);
+                if (eventName === "token") {
+                    paragraph = paragraph || createBotMessage();
+                    paragraph.textContent += data.token;
+                    chatbox.scrollTop = chatbox.scrollHeight;
+                } else if (eventName === "done") {
+                    handleBotResponse(data, paragraph);
+                }
+            }
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        appendMessage("bot", "Sorry, something went wrong!");
+    }
 }
 
 // Deal and No Deal button event handlers
@@ -107,10 +176,11 @@ function initializeBackend(message) {
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ message: message })
+        body: JSON.stringify({ message: message, session_id: sessionId, sku: productSku })
     })
         .then(response => response.json())
         .then(data => {
+            sessionId = data.session_id || null;
             const botMessage = data.response || "Sorry, no response!";
             appendMessage("bot", botMessage, true);  // Display the bot's response with typing effect
         })